@@ -19,6 +19,7 @@
 import errno
 import select
 import socket
+import courier.breaker
 import courier.config
 
 
@@ -107,11 +108,27 @@ def _read_auth(auth_sock, term):
     return data.split('\n')
 
 
-def _do_auth(cmd):
-    """Send cmd to the authdaemon, and return a dictionary containing its reply."""
+def _request(cmd):
     auth_sock = _connect()
-    _write_auth(auth_sock, cmd)
-    auth_data = _read_auth(auth_sock, '\n.\n')
+    try:
+        _write_auth(auth_sock, cmd)
+        return _read_auth(auth_sock, '\n.\n')
+    finally:
+        auth_sock.close()
+
+
+def _probe():
+    _connect().close()
+
+
+def _do_auth(cmd):
+    """Send cmd to the authdaemon, and return a dictionary containing its reply.
+
+    IOError is raised if the authdaemon can't be reached, or
+    courier.breaker.CircuitOpenError if it has failed repeatedly.
+
+    """
+    auth_data = _breaker.call(_request, cmd)
     auth_info = {}
     for auth_line in auth_data:
         if auth_line == 'FAIL':
@@ -133,5 +150,7 @@ def get_user_info(service, uid):
 # Call _setup to correct the socket path
 _setup()
 
+_breaker = courier.breaker.get_breaker('authdaemon', _probe)
+
 # Deprecated names preserved for compatibility with older releases
 getUserInfo = get_user_info
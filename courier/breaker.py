@@ -0,0 +1,183 @@
+# courier.breaker -- python module for failing fast when a service is down
+# Copyright (C) 2003-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Circuit breakers for services that filters depend on.
+
+When a service such as clamd or spamd is down, every message would
+otherwise wait for the connection to fail.  A filter wraps its calls to
+the service in Breaker.call.  After failure_threshold consecutive
+failures, the breaker opens, and further calls raise CircuitOpenError
+immediately, so that the filter can return its fallback reply.  While
+the breaker is open, a background thread runs the breaker's probe
+function every reset_timeout seconds, and closes the breaker when the
+probe succeeds.
+
+"""
+
+import sys
+import time
+import _thread
+import courier.config
+import courier.metrics
+
+
+# The number of consecutive failures which opens a breaker.
+failure_threshold = 5
+# The number of seconds between probes of a service while its breaker
+# is open.
+reset_timeout = 30
+
+CLOSED = 'closed'
+HALF_OPEN = 'half-open'
+OPEN = 'open'
+
+# The values of the breaker_state gauge.
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+breaker_state = courier.metrics.registry.gauge(
+    'pythonfilter_breaker_state',
+    'State of each circuit breaker: 0 closed, 1 half-open, 2 open', ('breaker',))
+breaker_trips = courier.metrics.registry.counter(
+    'pythonfilter_breaker_trips',
+    'Times that each circuit breaker opened', ('breaker',))
+breaker_rejections = courier.metrics.registry.counter(
+    'pythonfilter_breaker_rejections',
+    'Calls refused by each circuit breaker while it was open', ('breaker',))
+
+# Breakers by name, so that filters which are initialized again keep
+# the state of their services.
+breakers = {}
+breakers_lock = _thread.allocate_lock()
+
+
+class CircuitOpenError(IOError):
+    """Raised instead of calling a service whose breaker is open."""
+    pass
+
+
+class Breaker:
+    """A circuit breaker for one service.
+
+    Arguments:
+    name -- the name of the service, used in logs and metrics
+    probe -- a function which raises an exception if the service is
+             still unavailable
+    failures -- the number of consecutive failures which opens the
+                breaker
+    timeout -- the number of seconds between probes while the breaker
+               is open
+
+    The breaker is "half-open" while its probe is running.  Calls are
+    refused until the probe succeeds.
+
+    """
+    def __init__(self, name, probe, failures=failure_threshold, timeout=reset_timeout):
+        self.name = name
+        self.probe = probe
+        self.failures = failures
+        self.timeout = timeout
+        self.lock = _thread.allocate_lock()
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        breaker_state.set(STATE_VALUES[CLOSED], name)
+
+    def _set_state(self, state):
+        self.state = state
+        breaker_state.set(STATE_VALUES[state], self.name)
+
+    def check(self):
+        """Raise CircuitOpenError if the service shouldn't be called."""
+        if self.state != CLOSED:
+            breaker_rejections.inc(self.name)
+            raise CircuitOpenError('%s is unavailable' % self.name)
+
+    def record_success(self):
+        self.consecutive_failures = 0
+
+    def record_failure(self, error=None):
+        self.lock.acquire()
+        try:
+            self.consecutive_failures += 1
+            if self.state != CLOSED or self.consecutive_failures < self.failures:
+                return
+            self._set_state(OPEN)
+        finally:
+            self.lock.release()
+        breaker_trips.inc(self.name)
+        sys.stderr.write('Circuit breaker for %s opened after %d failures: %s\n' %
+                         (self.name, self.consecutive_failures, error))
+        _thread.start_new_thread(self._probe_until_closed, ())
+
+    def call(self, function, *args, errors=(OSError,)):
+        """Call function with args, and return its result.
+
+        Exceptions which are instances of errors count as failures of
+        the service, and are raised again.  CircuitOpenError is raised
+        without calling function while the breaker is open.
+
+        """
+        self.check()
+        try:
+            result = function(*args)
+        except errors as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+        return result
+
+    def _probe_until_closed(self):
+        while True:
+            time.sleep(self.timeout)
+            self._set_state(HALF_OPEN)
+            try:
+                self.probe()
+            except Exception as e:
+                self._set_state(OPEN)
+                sys.stderr.write('Circuit breaker for %s remains open: %s\n' %
+                                 (self.name, e))
+                continue
+            self.lock.acquire()
+            self.consecutive_failures = 0
+            self._set_state(CLOSED)
+            self.lock.release()
+            sys.stderr.write('Circuit breaker for %s closed\n' % self.name)
+            return
+
+
+def get_breaker(name, probe):
+    """Return the breaker for the service name, creating it if needed.
+
+    The breaker uses the failure_threshold and reset_timeout settings
+    from the "breaker.py" section of pythonfilter-modules.conf, which
+    are read again each time this function is called.
+
+    """
+    courier.config.apply_module_config('breaker.py', globals())
+    breakers_lock.acquire()
+    try:
+        breaker = breakers.get(name)
+        if breaker is None:
+            breaker = Breaker(name, probe, failure_threshold, reset_timeout)
+            breakers[name] = breaker
+        else:
+            breaker.probe = probe
+            breaker.failures = failure_threshold
+            breaker.timeout = reset_timeout
+        return breaker
+    finally:
+        breakers_lock.release()
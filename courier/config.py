@@ -23,6 +23,7 @@ import os
 import socket
 import subprocess
 import sys
+import time
 
 try:
     import DNS
@@ -209,29 +210,96 @@ def locallowercase():
     return 0
 
 
+class _LocalsMatcher:
+    """The domains listed in the "locals" file, compiled for lookups.
+
+    Exact entries and "!" exclusions are kept in a dictionary, and
+    ".domain" entries in a trie of their labels, from the last label
+    to the first.  Each entry records the line on which it appeared,
+    because the first line that matches a domain determines whether
+    it is local.
+
+    """
+    def __init__(self, lines):
+        # Maps each domain to the line number of its first entry, and
+        # whether that entry makes it local.
+        self.exact = {}
+        self.suffixes = {}
+        for (line_number, line) in enumerate(lines):
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            if line[0] == '!':
+                self.exact.setdefault(line[1:], (line_number, 0))
+            elif line[0] == '.':
+                node = self.suffixes
+                for label in reversed(line[1:].split('.')):
+                    node = node.setdefault(label, {})
+                # None can't be a label, so it marks the end of an entry.
+                node.setdefault(None, line_number)
+            else:
+                self.exact.setdefault(line, (line_number, 1))
+
+    def match(self, domain):
+        result = self.exact.get(domain, (None, 0))
+        # A ".domain" entry matches domains which have at least one
+        # more label.  Every matching entry is considered, since a
+        # shorter suffix may be listed before a longer one.
+        labels = domain.split('.')
+        node = self.suffixes
+        for label in reversed(labels[1:]):
+            node = node.get(label)
+            if node is None:
+                break
+            line_number = node.get(None)
+            if line_number is not None and (result[0] is None or line_number < result[0]):
+                result = (line_number, 1)
+        return result[1]
+
+
+# The number of seconds for which the compiled "locals" file is used
+# before checking whether the file has changed.
+locals_check_interval = 1
+
+# The path of the "locals" file, its (st_ino, st_mtime_ns) when it was
+# compiled, or None if it doesn't exist, its _LocalsMatcher, and the
+# time when the file was last checked.
+_locals = (None, None, None, 0)
+
+
+def _get_locals():
+    global _locals
+    locals_path = '%s/locals' % sysconfdir
+    (path, identity, matcher, checked) = _locals
+    now = time.monotonic()
+    if path == locals_path and now - checked < locals_check_interval:
+        return matcher
+    try:
+        locals_stat = os.stat(locals_path)
+        new_identity = (locals_stat.st_ino, locals_stat.st_mtime_ns)
+        if path != locals_path or new_identity != identity:
+            with open(locals_path) as locals_file:
+                matcher = _LocalsMatcher(locals_file)
+    except (OSError, IOError):
+        (new_identity, matcher) = (None, None)
+    _locals = (locals_path, new_identity, matcher, now)
+    return matcher
+
+
 def is_local(domain):
     """Return True if domain is "local", and False otherwise.
 
     See the courier(8) man page for more information on local domains.
+    The "locals" file is compiled when it is first needed, and again
+    when it changes.
 
     """
-    try:
-        locals_ = open('%s/locals' % sysconfdir)
-    except IOError:
+    matcher = _get_locals()
+    if matcher is None:
         if domain == me():
             return 1
         return 0
-    for line in locals_.readlines():
-        if line[0] in '#\n':
-            continue
-        line = line.strip()
-        if line[0] == '!' and line[1:] == domain:
-            return 0
-        if line[0] == '.' and domain.endswith(line):
-            return 1
-        if line == domain:
-            return 1
-    return 0
+    return matcher.match(domain)
 
 
 def is_hosteddomain(domain):
@@ -0,0 +1,180 @@
+# courier.context -- python module for sharing message details among filters
+# Copyright (C) 2003-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+import copy
+import email
+import os
+import _thread
+import courier.control
+
+
+class MessageContext:
+    """Details of one message, shared by the filters that process it.
+
+    pythonfilter creates one MessageContext for each message, and gives
+    it to filters whose do_filter function accepts a third argument.
+    Values are read from the control files the first time that they
+    are requested, and are cached for the filters that follow.
+
+    The cache is discarded whenever the size or modification time of
+    any of the control files changes, so values remain correct after
+    a filter calls courier.control.add_recipient_data or
+    courier.control.del_recipient_data, or commits a
+    courier.control.edit.
+
+    The message body is parsed only if a filter calls get_message, and
+    the parsed message is shared by all of the filters.  Filters that
+    modify the message should work on a copy from copy_message, or use
+    courier.xfilter.XFilter, which will replace the shared message when
+    the modified message is submitted.
+
+    Arguments:
+    body_path -- the same argument given to the do_filter function
+    control_paths -- the same argument given to the do_filter function
+
+    """
+    def __init__(self, body_path, control_paths):
+        self.body_path = body_path
+        self.control_paths = control_paths
+        self._lock = _thread.allocate_lock()
+        self._cache = {}
+        self._control_set = None
+        self._files_state = None
+        self._message_lock = _thread.allocate_lock()
+        self._message = None
+        self._body_state = None
+
+    def _get_body_state(self):
+        body_stat = os.stat(self.body_path)
+        return (body_stat.st_size, body_stat.st_mtime_ns)
+
+    def _get_files_state(self):
+        state = []
+        for control_path in self.control_paths:
+            control_stat = os.stat(control_path)
+            state.append((control_stat.st_size, control_stat.st_mtime_ns))
+        return tuple(state)
+
+    def _get(self, name, function, *args):
+        files_state = self._get_files_state()
+        self._lock.acquire()
+        try:
+            if files_state != self._files_state:
+                self._cache = {}
+                self._control_set = None
+                self._files_state = files_state
+            if name not in self._cache:
+                # The control files are read once, and the values are
+                # taken from the same ControlSet.
+                if self._control_set is None:
+                    self._control_set = courier.control.ControlSet(self.control_paths)
+                self._cache[name] = function(self._control_set, *args)
+            return self._cache[name]
+        finally:
+            self._lock.release()
+
+    def get_sender(self):
+        """Return the envelope sender."""
+        return self._get('sender', courier.control.get_sender)
+
+    def get_senders_mta(self):
+        """Return the "Received-From-MTA" record."""
+        return self._get('senders_mta', courier.control.get_senders_mta)
+
+    def get_senders_ip(self):
+        """Return the IP address of the client that sent the message, or None."""
+        return self._get('senders_ip', courier.control.get_senders_ip)
+
+    def get_auth_user(self):
+        """Return the username used during SMTP AUTH, or None."""
+        return self._get('auth_user', courier.control.get_auth_user)
+
+    def get_message_id(self):
+        """Return Courier's queue ID for the message, or None."""
+        lines = self._get('M', courier.control.get_lines, 'M', 1)
+        if lines:
+            return lines[0]
+        return None
+
+    def get_recipients(self):
+        """Return a list of message recipients.
+
+        See courier.control.get_recipients for details.
+
+        """
+        return [x[0] for x in self._get('recipients_data',
+                                        courier.control.get_recipients_data)]
+
+    def get_recipients_data(self):
+        """Return a list of lists with details about message recipients.
+
+        See courier.control.get_recipients_data for details.  The lists
+        returned are copies, which the caller may modify.
+
+        """
+        return [x[:] for x in self._get('recipients_data',
+                                        courier.control.get_recipients_data)]
+
+    def get_control_data(self):
+        """Return a dictionary containing all of the data given to submit.
+
+        See courier.control.get_control_data for details.  The
+        dictionary returned is a copy, which the caller may modify.
+
+        """
+        data = dict(self._get('control_data', courier.control.get_control_data))
+        data['r'] = [x[:] for x in data['r']]
+        return data
+
+    def get_message(self):
+        """Return the message as an email.message.Message object.
+
+        The object is shared with other filters, and must not be
+        modified.  The message is parsed again if the body file has
+        been modified by some means other than set_message.
+
+        """
+        body_state = self._get_body_state()
+        self._message_lock.acquire()
+        try:
+            if self._message is None or body_state != self._body_state:
+                with open(self.body_path, 'rb') as body_file:
+                    self._message = email.message_from_binary_file(body_file)
+                self._body_state = body_state
+            return self._message
+        finally:
+            self._message_lock.release()
+
+    def copy_message(self):
+        """Return a copy of the message which the caller may modify."""
+        return copy.deepcopy(self.get_message())
+
+    def set_message(self, message):
+        """Replace the shared message after the body file was rewritten.
+
+        This should be called only after message has been written to
+        the body file, as courier.xfilter.XFilter.submit does.
+
+        """
+        body_state = self._get_body_state()
+        self._message_lock.acquire()
+        try:
+            self._message = message
+            self._body_state = body_state
+        finally:
+            self._message_lock.release()
@@ -16,9 +16,13 @@
 # You should have received a copy of the GNU General Public License
 # along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
 
+import array
+import collections
 import ipaddress
+import os
 import time
 import urllib.parse
+import _thread
 
 
 def try_decode(value):
@@ -31,6 +35,254 @@ def try_decode(value):
         )
 
 
+class Recipient(collections.namedtuple('Recipient', ('address', 'orcpt', 'dsn'))):
+    """A message recipient, as yielded by iter_recipients.
+
+    address -- the rewritten address
+    orcpt -- the "original message recipient", as defined by RFC1891
+    dsn -- zero or more characters indicating DSN behavior
+
+    """
+    __slots__ = ()
+
+
+# The keys of the records which describe recipients.
+_recipient_keys = (b'r', b'R', b'N', b'S', b'F')
+
+# The keys of records in the first control file which get_control_data
+# returns as strings, and those whose presence it reports as True.
+_control_data_values = b'sfeMitEpWvXUu'
+_control_data_flags = b'w8mVT'
+
+# The number of parsed control files which are kept, so that functions
+# called repeatedly for the same message don't read its files again.
+cache_size = 256
+# The total size of the files which are kept.  Larger files aren't
+# cached at all.
+cache_bytes = 4 * 1024 * 1024
+
+# Maps each path to a tuple of the (st_ino, st_size, st_mtime_ns) of the
+# file when it was read, and its ControlFile.  The least recently used
+# entries are discarded.
+_cache = collections.OrderedDict()
+_cache_total = 0
+_cache_lock = _thread.allocate_lock()
+
+
+class ControlFile:
+    """The records of one control file, read in a single pass.
+
+    The file is read once, and an index of the offsets of the records
+    with each key is built.  Values are decoded only when they are
+    first requested.  Recipient records are indexed compactly, and
+    decoded each time that they are iterated, since a message may have
+    tens of thousands of recipients.
+
+    """
+    def __init__(self, control_path):
+        self.path = control_path
+        with open(control_path, 'rb') as control_file:
+            self.data = control_file.read()
+        # Maps each key, other than recipient keys, to a list of
+        # (start, end) offsets of its values.
+        self.index = {}
+        # The start offsets of the values of recipient records, in the
+        # file's order.
+        self.recipient_offsets = array.array('q')
+        self._values = {}
+        self._completed = None
+        data = self.data
+        length = len(data)
+        position = 0
+        while position < length:
+            end = data.find(b'\n', position)
+            if end < 0:
+                end = length
+            key = data[position:position + 1]
+            if key in _recipient_keys:
+                self.recipient_offsets.append(position + 1)
+            else:
+                self.index.setdefault(key, []).append((position + 1, end))
+            position = end + 1
+
+    def _recipient_records(self):
+        data = self.data
+        for start in self.recipient_offsets:
+            end = data.find(b'\n', start)
+            if end < 0:
+                end = len(data)
+            yield (data[start - 1:start], start, end)
+
+    def has_key(self, key):
+        """Return True if the file has a record with key, a byte string."""
+        if key in _recipient_keys:
+            return any(x[0] == key for x in self._recipient_records())
+        return key in self.index
+
+    def values(self, key):
+        """Return a list of the decoded values of records with key.
+
+        key is a one character byte string.
+
+        """
+        if key in _recipient_keys:
+            return [try_decode(self.data[start:end])
+                    for (record_key, start, end) in self._recipient_records()
+                    if record_key == key]
+        values = self._values.get(key)
+        if values is None:
+            values = [try_decode(self.data[start:end])
+                      for (start, end) in self.index.get(key, ())]
+            self._values[key] = values
+        return values
+
+    def completed(self):
+        """Return the set of indexes of recipients whose delivery is complete."""
+        if self._completed is None:
+            completed = set()
+            for (key, start, end) in self._recipient_records():
+                if key in (b'S', b'F'):
+                    # Control file records either a successful or failed
+                    # delivery.  Either way, mark this recipient completed.
+                    completed.add(int(self.data[start:end].split(b' ', 1)[0]))
+            self._completed = completed
+        return self._completed
+
+    def iter_recipients(self):
+        """Yield (index, delivered, Recipient) for each recipient in the file."""
+        completed = self.completed()
+        index = 0
+        rbuf = ['', '', ''] # This list will contain the recipient data.
+        for (key, start, end) in self._recipient_records():
+            if key == b'r':
+                rbuf[0] = try_decode(self.data[start:end])
+            elif key == b'R':
+                rbuf[1] = try_decode(self.data[start:end])
+            elif key == b'N':
+                rbuf[2] = try_decode(self.data[start:end])
+                # This completes a new record.
+                if rbuf[0]:
+                    yield (index, index in completed, Recipient(*rbuf))
+                    index += 1
+                rbuf = ['', '', '']
+
+    def recipients(self):
+        """Return a list of lists with details about message recipients.
+
+        See _get_recipients_from_file for the format.
+
+        """
+        return [[index, delivered, list(recipient)]
+                for (index, delivered, recipient) in self.iter_recipients()]
+
+
+def _get_control_file(control_path):
+    """Return a ControlFile for control_path, from the cache if it is current."""
+    global _cache_total
+    # The file is examined before it is read, so if it changes in
+    # between, the entry won't match the next time.
+    control_stat = os.stat(control_path)
+    identity = (control_stat.st_ino, control_stat.st_size, control_stat.st_mtime_ns)
+    _cache_lock.acquire()
+    try:
+        entry = _cache.get(control_path)
+        if entry is not None and entry[0] == identity:
+            _cache.move_to_end(control_path)
+            return entry[1]
+    finally:
+        _cache_lock.release()
+    control_file = ControlFile(control_path)
+    if len(control_file.data) > cache_bytes:
+        return control_file
+    _cache_lock.acquire()
+    try:
+        _discard(control_path)
+        _cache[control_path] = (identity, control_file)
+        _cache_total += len(control_file.data)
+        while len(_cache) > cache_size or _cache_total > cache_bytes:
+            _discard(next(iter(_cache)))
+    finally:
+        _cache_lock.release()
+    return control_file
+
+
+def _discard(control_path):
+    """Remove control_path from the cache.  _cache_lock must be held."""
+    global _cache_total
+    entry = _cache.pop(control_path, None)
+    if entry is not None:
+        _cache_total -= len(entry[1].data)
+
+
+def _invalidate(control_path):
+    """Discard the cached ControlFile for a file that was modified."""
+    _cache_lock.acquire()
+    _discard(control_path)
+    _cache_lock.release()
+
+
+class ControlSet:
+    """The control files of one message, each read once.
+
+    The module's functions accept a ControlSet in place of a list of
+    control file paths, so that callers which need several values can
+    share one set rather than reading the files again for each value.
+    A ControlSet isn't updated when the files are modified; create a
+    new one.
+
+    """
+    def __init__(self, control_paths):
+        self.paths = list(control_paths)
+        self.files = [_get_control_file(x) for x in self.paths]
+        self._senders_ip = False
+
+    def get_lines(self, key, max_lines=0):
+        """Return a list of values matching key, as get_lines does."""
+        key = key.encode('ascii')
+        lines = []
+        for control_file in self.files:
+            lines.extend(control_file.values(key))
+            if max_lines and len(lines) >= max_lines:
+                return lines[:max_lines]
+        return lines
+
+    def get_senders_ip(self):
+        """Return the IP address of the client, as get_senders_ip does."""
+        if self._senders_ip is False:
+            self._senders_ip = None
+            for line in self.get_lines('O'):
+                if line.startswith('TCPREMOTEIP='):
+                    sender_ip = ipaddress.ip_address(line[12:])
+                    if isinstance(sender_ip, ipaddress.IPv6Address) and sender_ip.ipv4_mapped:
+                        sender_ip = sender_ip.ipv4_mapped
+                    self._senders_ip = str(sender_ip)
+                    break
+        return self._senders_ip
+
+    def iter_recipients(self):
+        """Yield undelivered recipients, as iter_recipients does."""
+        for control_file in self.files:
+            for (index, delivered, recipient) in control_file.iter_recipients():
+                if not delivered:
+                    yield recipient
+
+    def get_recipients_data(self):
+        """Return details of undelivered recipients, as get_recipients_data does."""
+        return [list(x) for x in self.iter_recipients()]
+
+
+def _control_set(control_paths):
+    if isinstance(control_paths, ControlSet):
+        return control_paths
+    return ControlSet(control_paths)
+
+
+def _paths(control_paths):
+    if isinstance(control_paths, ControlSet):
+        return control_paths.paths
+    return control_paths
+
+
 def get_lines(control_paths, key, max_lines=0):
     """Return a list of values in the control_paths matching key.
 
@@ -43,16 +295,7 @@ def get_lines(control_paths, key, max_lines=0):
     be returned.
 
     """
-    key = key.encode('ascii')
-    lines = []
-    for control_path in control_paths:
-        with open(control_path, 'rb') as control_file:
-            for control_line in control_file:
-                if control_line[:1] == key:
-                    lines.append(try_decode(control_line[1:]))
-                    if max_lines and len(lines) == max_lines:
-                        break
-    return lines
+    return _control_set(control_paths).get_lines(key, max_lines)
 
 
 def get_senders_mta(control_paths):
@@ -70,14 +313,7 @@ def get_senders_mta(control_paths):
 
 def get_senders_ip(control_paths):
     """Return an IP address if one is found in the "Received-From-MTA" record."""
-    sender = get_lines(control_paths, 'O')
-    for line in sender:
-        if line.startswith('TCPREMOTEIP='):
-            sender_ip = ipaddress.ip_address(line[12:])
-            if isinstance(sender_ip, ipaddress.IPv6Address) and sender_ip.ipv4_mapped:
-                return str(sender_ip.ipv4_mapped)
-            return str(sender_ip)
-    return None
+    return _control_set(control_paths).get_senders_ip()
 
 
 def get_sender(control_paths):
@@ -95,7 +331,18 @@ def get_recipients(control_paths):
     address rewriting and alias expansion.
 
     """
-    return [x[0] for x in get_recipients_data(control_paths)]
+    return [x.address for x in iter_recipients(control_paths)]
+
+
+def iter_recipients(control_paths):
+    """Yield a Recipient for each recipient that hasn't been delivered.
+
+    The recipients are read as they are needed, rather than collected
+    in a list, so this is the best way to examine messages with very
+    many recipients.
+
+    """
+    return _control_set(control_paths).iter_recipients()
 
 
 def get_recipients_data(control_paths):
@@ -107,13 +354,7 @@ def get_recipients_data(control_paths):
     2: Zero or more characters indicating DSN behavior.
 
     """
-    recipients_data = []
-    for control_path in control_paths:
-        rcpts = _get_recipients_from_file(control_path)
-        for rcpt in rcpts:
-            if rcpt[1] is False:
-                recipients_data.append(rcpt[2])
-    return recipients_data
+    return _control_set(control_paths).get_recipients_data()
 
 
 def _get_recipients_from_file(control_path):
@@ -128,30 +369,7 @@ def _get_recipients_from_file(control_path):
         2: Zero or more characters indicating DSN behavior.
 
     """
-    recipients = []
-    rbuf = ['', '', ''] # This list will contain the recipient data.
-    with open(control_path, 'rb') as control_file:
-        for control_line in control_file:
-            control_key = control_line[:1]
-            control_val = control_line[1:]
-            if control_key == b'r':
-                rbuf[0] = try_decode(control_val)
-            if control_key == b'R':
-                rbuf[1] = try_decode(control_val)
-            if control_key == b'N':
-                rbuf[2] = try_decode(control_val)
-                # This completes a new record, add it to the recipient data list.
-                if rbuf and rbuf[0]:
-                    rcpt = [len(recipients), False, rbuf]
-                    recipients.append(rcpt)
-                rbuf = ['', '', '']
-            if control_key in (b'S', b'F'):
-                # Control file records either a successful or failed
-                # delivery.  Either way, mark this recipient completed.
-                rnum = control_line.split(b' ', 1)[0]
-                rnum = int(rnum[1:])
-                recipients[rnum][1] = True
-    return recipients
+    return _get_control_file(control_path).recipients()
 
 
 def get_control_data(control_paths):
@@ -208,18 +426,160 @@ def get_control_data(control_paths):
             'u': None,
             'T': False,
             'r': []}
-    with open(control_paths[0], 'rb') as control_file:
-        for control_line in control_file:
-            control_key = control_line[:1]
-            control_val = control_line[1:]
-            if control_key in b'sfeMitEpWvXUu':
-                data[control_key.decode('ascii')] = try_decode(control_val)
-            if control_key in b'w8mVT':
-                data[control_key.decode('ascii')] = True
-    data['r'] = get_recipients_data(control_paths)
+    control_set = _control_set(control_paths)
+    control_file = control_set.files[0]
+    for x in _control_data_values:
+        key = bytes((x,))
+        values = control_file.values(key)
+        if values:
+            # The last record with each key takes effect.
+            data[key.decode('ascii')] = values[-1]
+    for x in _control_data_flags:
+        key = bytes((x,))
+        if control_file.has_key(key):
+            data[key.decode('ascii')] = True
+    data['r'] = control_set.get_recipients_data()
     return data
 
 
+class ControlEdit:
+    """A batch of changes to the recipients of a message.
+
+    Use edit to create one.  The control files are parsed once, and
+    any number of recipients may be added and removed.  The records
+    for the changes are written when the edit is committed, with one
+    write to each control file that changed.  Until then, the files
+    are unchanged, and get_recipients_data reports the recipients as
+    they will be.
+
+    New recipients are added to the last control file, however many
+    recipients it already has.  Courier limits the recipients in each
+    control file that it writes (its "batchsize" setting), but a filter
+    can't start a new file: the message's control files are named when
+    it is submitted, and it isn't known that Courier reads a file which
+    is created afterward, so its recipients could be lost.
+
+    """
+    def __init__(self, control_paths, sync=False):
+        self.control_paths = control_paths
+        self.paths = list(_paths(control_paths))
+        self.sync = sync
+        # (path, index, Recipient) of each undelivered recipient, or
+        # None once the recipient is removed.
+        self.pending = []
+        # Map each Recipient, and each address, to a deque of the
+        # positions of its entries in pending, in order.  Positions
+        # of removed recipients are discarded when they are reached.
+        self.by_recipient = {}
+        self.by_address = {}
+        for control_path in self.paths:
+            self.next_index = 0
+            for (index, delivered, recipient) in _get_control_file(control_path).iter_recipients():
+                if not delivered:
+                    self._append(control_path, index, recipient)
+                self.next_index = index + 1
+        # New recipients are added to the last file, at next_index.
+        # Records waiting to be written to each file.
+        self.records = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # If the block raised an exception, nothing is written.
+        if exc_type is None:
+            self.commit()
+        return False
+
+    def get_recipients_data(self):
+        """Return the recipients which haven't been delivered or removed."""
+        return [list(x[2]) for x in self.pending if x is not None]
+
+    def _append(self, control_path, index, recipient):
+        position = len(self.pending)
+        self.pending.append((control_path, index, recipient))
+        self.by_recipient.setdefault(recipient, collections.deque()).append(position)
+        self.by_address.setdefault(recipient.address, collections.deque()).append(position)
+
+    def add_recipient(self, recipient):
+        """Add a recipient, as add_recipient does."""
+        self.add_recipient_data([recipient, '', ''])
+
+    def add_recipient_data(self, recipient_data):
+        """Add a recipient, as add_recipient_data does."""
+        if len(recipient_data) != 3:
+            raise ValueError('recipient_data must be a list of 3 values.')
+        control_path = self.paths[-1]
+        self.records.setdefault(control_path, []).append(
+            'r%s\nR%s\nN%s\n' % tuple(recipient_data))
+        self._append(control_path, self.next_index, Recipient(*recipient_data))
+        self.next_index += 1
+
+    def del_recipient(self, recipient):
+        """Remove the first recipient with the canonical address recipient.
+
+        Returns True if a recipient was removed.
+
+        """
+        return self._remove(self.by_address.get(recipient))
+
+    def del_recipient_data(self, recipient_data):
+        """Remove the first recipient matching recipient_data.
+
+        Returns True if a recipient was removed.
+
+        """
+        if len(recipient_data) != 3:
+            raise ValueError('recipient_data must be a list of 3 values.')
+        return self._remove(self.by_recipient.get(tuple(recipient_data)))
+
+    def _remove(self, positions):
+        # Remove the first recipient in positions which hasn't already
+        # been removed.
+        while positions:
+            position = positions.popleft()
+            if self.pending[position] is None:
+                continue
+            (control_path, index, recipient) = self.pending[position]
+            self.pending[position] = None
+            # Mark the delivery completed, successfully.
+            self.records.setdefault(control_path, []).append(
+                'I%d R 250 Ok - Removed by courier.control.py\nS%d %d\n' %
+                (index, index, int(time.time())))
+            return True
+        return False
+
+    def commit(self):
+        """Append the records for the changes made so far."""
+        for control_path in self.paths:
+            records = self.records.pop(control_path, None)
+            if not records:
+                continue
+            fd = os.open(control_path, os.O_WRONLY | os.O_APPEND)
+            with open(fd, 'w') as control_file:
+                control_file.write(''.join(records))
+                if self.sync:
+                    control_file.flush()
+                    os.fsync(control_file.fileno())
+            _invalidate(control_path)
+
+def edit(control_paths, sync=False):
+    """Return a ControlEdit for a batch of changes to the recipients.
+
+    Use it as a context manager, which commits the changes at the end
+    of the block unless the block raises an exception:
+
+      with courier.control.edit(control_paths) as tx:
+          tx.add_recipient_data(new_rcpt)
+          tx.del_recipient_data(old_rcpt)
+
+    If sync is True, each modified file is synced to disk when the
+    changes are committed.
+
+    """
+    return ControlEdit(control_paths, sync)
+
+
 def add_recipient(control_paths, recipient):
     """Add a recipient to a control_paths set.
 
@@ -236,30 +596,13 @@ def add_recipient_data(control_paths, recipient_data):
 
     The recipient_data argument must contain the same information that
     is normally returned by the get_recipients_data function for each
-    recipient.  Recipients should be added one at a time.
+    recipient.  To add several recipients, use edit.
 
     """
-    # FIXME:  How strict is courier about its upper limit of
-    # recipients per control file?  It's easiest to append the
-    # recipient to the last control file, but it would be more
-    # robust to check the number of recipients in it first and
-    # create a new file if necessary.
     if len(recipient_data) != 3:
         raise ValueError('recipient_data must be a list of 3 values.')
-    control_path = control_paths[-1]
-    with open(control_path, 'a') as control_file:
-        control_file.write('r%s\n' % recipient_data[0])
-        control_file.write('R%s\n' % recipient_data[1])
-        control_file.write('N%s\n' % recipient_data[2])
-
-
-def _mark_complete(control_path, recipient_index):
-    """Mark a single recipient's delivery as completed."""
-    with open(control_path, 'a') as control_file:
-        control_file.seek(0, 2) # Seek to the end of the file
-        control_file.write('I%d R 250 Ok - Removed by courier.control.py\n' %
-                           recipient_index)
-        control_file.write('S%d %d\n' % (recipient_index, int(time.time())))
+    with edit(control_paths) as tx:
+        tx.add_recipient_data(recipient_data)
 
 
 def del_recipient(control_paths, recipient):
@@ -273,16 +616,11 @@ def del_recipient(control_paths, recipient):
     complete, successfully.
 
     You should log all such removals so that messages are never
-    silently lost.
+    silently lost.  To remove several recipients, use edit.
 
     """
-    for control_path in control_paths:
-        rcpts = _get_recipients_from_file(control_path)
-        for rcpt in rcpts:
-            if(rcpt[1] is False # Delivery is not complete for this recipient
-               and rcpt[2][0] == recipient):
-                _mark_complete(control_path, rcpt[0])
-                return
+    with edit(control_paths) as tx:
+        tx.del_recipient(recipient)
 
 
 def del_recipient_data(control_paths, recipient_data):
@@ -297,18 +635,13 @@ def del_recipient_data(control_paths, recipient_data):
     complete, successfully.
 
     You should log all such removals so that messages are never
-    silently lost.
+    silently lost.  To remove several recipients, use edit.
 
     """
     if len(recipient_data) != 3:
         raise ValueError('recipient_data must be a list of 3 values.')
-    for cf in control_paths:
-        rcpts = _get_recipients_from_file(cf)
-        for x in rcpts:
-            if(x[1] is False # Delivery is not complete for this recipient
-               and x[2] == recipient_data):
-                _mark_complete(cf, x[0])
-                return
+    with edit(control_paths) as tx:
+        tx.del_recipient_data(recipient_data)
 
 
 def get_auth_user(control_paths, body_file=None):
@@ -0,0 +1,277 @@
+# courier.isolate -- python module for running filters in subprocesses
+# Copyright (C) 2003-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Run a filter's do_filter function in a pool of worker processes.
+
+Each worker process is started with "python3 -m courier.isolate
+<module>".  It imports pythonfilter.<module>, runs its init_filter
+function, and then reads requests from stdin in the same format that
+courierfilter uses: the path of the message body, the paths of the
+control files, and a blank line.  For each request, the worker writes
+a header line containing its maximum RSS in KiB and the length of the
+reply, followed by the reply itself.  A length of -1 indicates that
+do_filter raised an exception, which the worker has logged.  A reply
+that isn't a string is logged and sent as an empty reply, as the
+dispatcher treats one from a filter that it runs itself.
+
+"""
+
+import asyncio
+import os
+import resource
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+import _thread
+
+
+class IsolateError(Exception):
+    """Raised when a worker process fails to reply."""
+    pass
+
+
+class FilterError(IsolateError):
+    """Raised when the filter raised an exception in the worker."""
+    pass
+
+
+class WorkerTimeout(IsolateError):
+    """Raised when a worker process doesn't reply in time."""
+    pass
+
+
+class Worker:
+    """One worker process, running a filter module."""
+    def __init__(self, module_name):
+        # Workers import modules from the same path as this process.
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([x for x in sys.path if x]))
+        self.process = subprocess.Popen([sys.executable, '-m', 'courier.isolate', module_name],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        env=env)
+        self.messages = 0
+        self.rss = 0
+
+    def request(self, body_path, control_paths, deadline):
+        """Send a request, and return the reply from the filter.
+
+        WorkerTimeout is raised if the reply isn't complete by deadline,
+        a time.time() value, unless it is None.
+
+        """
+        request = '%s\n%s\n' % (body_path, ''.join(['%s\n' % x for x in control_paths]))
+        try:
+            self.process.stdin.write(request.encode())
+            self.process.stdin.flush()
+        except OSError as e:
+            raise IsolateError('worker process failed: %s' % e)
+        header = b''
+        while not header.endswith(b'\n'):
+            header += self._read(1, deadline)
+        (rss, length) = [int(x) for x in header.split()]
+        self.messages += 1
+        self.rss = rss
+        if length < 0:
+            raise FilterError('do_filter raised an exception in the worker process')
+        reply = b''
+        while len(reply) < length:
+            reply += self._read(length - len(reply), deadline)
+        return reply.decode()
+
+    def _read(self, size, deadline):
+        fd = self.process.stdout.fileno()
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+                raise WorkerTimeout('worker process timed out')
+        data = os.read(fd, size)
+        if not data:
+            raise IsolateError('worker process exited with status %s' %
+                               self.process.wait())
+        return data
+
+    def stop(self):
+        """Ask the worker to exit once it has finished its request."""
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.stdout.close()
+        _thread.start_new_thread(self.process.wait, ())
+
+    def kill(self):
+        try:
+            self.process.kill()
+        except OSError:
+            pass
+        self.stop()
+
+
+class Pool:
+    """A pool of worker processes for one filter module.
+
+    Workers are started when they are needed, up to workers at a time.
+    A worker is replaced after it has processed max_messages messages,
+    or when its maximum RSS exceeds max_rss KiB.  0 disables either
+    limit.  The RSS is checked after each message, so max_rss recycles
+    workers that have grown; it doesn't limit the memory that one
+    message may use.  A worker that doesn't reply within the timeout
+    given to call is killed.
+
+    """
+    def __init__(self, module_name, workers, max_messages=0, max_rss=0):
+        self.module_name = module_name
+        self.workers = workers
+        self.max_messages = max_messages
+        self.max_rss = max_rss
+        self.condition = threading.Condition()
+        self.idle = []
+        self.running = 0
+        self.closed = False
+        self.pid = os.getpid()
+
+    def _get_worker(self, deadline):
+        with self.condition:
+            # Workers started by a parent process belong to it.
+            if self.pid != os.getpid():
+                self.idle = []
+                self.running = 0
+                self.pid = os.getpid()
+            while not self.idle and self.running >= self.workers:
+                if deadline is None:
+                    self.condition.wait()
+                elif not self.condition.wait(deadline - time.time()):
+                    raise WorkerTimeout('no worker process was free in time')
+            self.running += 1
+            if self.idle:
+                return self.idle.pop()
+        try:
+            return Worker(self.module_name)
+        except Exception:
+            self._release(None)
+            raise
+
+    def _release(self, worker):
+        with self.condition:
+            self.running -= 1
+            if worker is not None:
+                if(self.closed
+                   or (self.max_messages and worker.messages >= self.max_messages)
+                   or (self.max_rss and worker.rss > self.max_rss)):
+                    worker.stop()
+                else:
+                    self.idle.append(worker)
+            self.condition.notify()
+
+    def call(self, body_path, control_paths, timeout=0):
+        """Run the filter in a worker, and return its reply.
+
+        FilterError is raised if do_filter raised an exception,
+        WorkerTimeout is raised if no worker is free and replies within
+        timeout seconds, and IsolateError is raised if it fails.
+
+        """
+        deadline = None
+        if timeout:
+            deadline = time.time() + timeout
+        worker = self._get_worker(deadline)
+        try:
+            reply = worker.request(body_path, control_paths, deadline)
+        except FilterError:
+            # The worker is still usable.
+            self._release(worker)
+            raise
+        except Exception:
+            worker.kill()
+            self._release(None)
+            raise
+        self._release(worker)
+        return reply
+
+    def close(self):
+        """Stop idle workers, and workers that are busy when they finish."""
+        with self.condition:
+            self.closed = True
+            for worker in self.idle:
+                worker.stop()
+            self.idle = []
+
+
+def max_rss():
+    """Return the maximum RSS of this process, in KiB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _init_module(module_name):
+    module = __import__('pythonfilter.%s' % module_name)
+    for c in module_name.split('.'):
+        module = getattr(module, c)
+    for name in ('initFilter', 'init_filter'):
+        if hasattr(module, name):
+            getattr(module, name)()
+    if hasattr(module, 'do_filter'):
+        return module.do_filter
+    return module.doFilter
+
+
+def _serve(module_name):
+    # Keep the reply pipe private, so that anything the filter writes
+    # to stdout is logged instead.
+    reply_fd = os.dup(1)
+    os.dup2(2, 1)
+    # The dispatcher handles SIGHUP and SIGINT.  Workers exit when
+    # stdin is closed.
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    do_filter = _init_module(module_name)
+    sys.stderr.flush()
+    while True:
+        body_path = sys.stdin.readline()
+        if not body_path:
+            break
+        control_paths = []
+        while True:
+            control_path = sys.stdin.readline()
+            if control_path in ('\n', ''):
+                break
+            control_paths.append(control_path.strip())
+        try:
+            reply = do_filter(body_path.strip(), control_paths)
+            if asyncio.iscoroutine(reply):
+                reply = asyncio.run(reply)
+        except Exception:
+            import traceback
+            filter_error = sys.exc_info()
+            sys.stderr.write('Uncaught exception in "%s" do_filter function: %s:%s\n' %
+                             (module_name, filter_error[0], filter_error[1]))
+            sys.stderr.write(''.join(traceback.format_tb(filter_error[2])))
+            sys.stderr.flush()
+            os.write(reply_fd, b'%d -1\n' % max_rss())
+            continue
+        if not isinstance(reply, str):
+            sys.stderr.write('"%s" do_filter function returned non-string\n' % module_name)
+            reply = ''
+        sys.stderr.flush()
+        reply = reply.encode()
+        os.write(reply_fd, b'%d %d\n' % (max_rss(), len(reply)) + reply)
+
+
+if __name__ == '__main__':
+    _serve(sys.argv[1])
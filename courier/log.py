@@ -0,0 +1,168 @@
+# courier.log -- python module for logging without waiting for stderr
+# Copyright (C) 2003-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Write log lines from many threads without waiting for stderr.
+
+Once start has been called, write puts each line in a queue, and a
+single writer thread writes the lines in batches to stderr or to
+syslog.  If the queue is full, the line is dropped and counted, rather
+than making the caller wait, and the writer logs the number of lines
+that were dropped.  Until start is called, for instance when a filter
+is run outside of pythonfilter, write writes lines to stderr
+immediately.
+
+In JSON mode, each line is a JSON object with the time, the message,
+and any fields given to write.
+
+"""
+
+import json
+import queue
+import sys
+import time
+import _thread
+import courier.metrics
+
+
+# The number of lines that the writer takes from the queue at once.
+batch_size = 100
+
+_queue = None
+_destination = 'stderr'
+_json_lines = False
+_dropped = 0
+_dropped_lock = _thread.allocate_lock()
+
+dropped_lines = courier.metrics.registry.counter(
+    'pythonfilter_log_dropped_lines',
+    'Log lines dropped because the log queue was full')
+queued_lines = courier.metrics.registry.gauge(
+    'pythonfilter_log_queued_lines',
+    'Log lines waiting to be written',
+    function=lambda: _queue.qsize() if _queue else 0)
+
+
+def format_line(log_time, message, fields):
+    if not _json_lines:
+        return message + '\n'
+    record = {'time': round(log_time, 6), 'message': message}
+    record.update(fields)
+    return json.dumps(record, default=str) + '\n'
+
+
+def _emit(lines):
+    if _destination == 'syslog':
+        import syslog
+        for line in lines:
+            syslog.syslog(syslog.LOG_INFO, line.rstrip('\n'))
+    else:
+        sys.stderr.write(''.join(lines))
+        sys.stderr.flush()
+
+
+def start(destination='stderr', size=10000, json_lines=False):
+    """Start the writer thread.
+
+    destination is 'stderr' or 'syslog'.  size is the number of lines
+    that may wait to be written; 0 makes write write each line
+    immediately.  If json_lines is True, lines are written as JSON.
+    The writer must be started in each process, after fork.
+
+    """
+    global _queue, _destination, _json_lines
+    if destination not in ('stderr', 'syslog'):
+        raise ValueError('unknown log destination "%s"' % destination)
+    if destination == 'syslog':
+        import syslog
+        syslog.openlog('pythonfilter', syslog.LOG_PID, syslog.LOG_MAIL)
+    _destination = destination
+    _json_lines = json_lines
+    if size:
+        _queue = queue.Queue(size)
+        _thread.start_new_thread(_write_lines, (_queue,))
+    else:
+        _queue = None
+
+
+def write(message, **fields):
+    """Log message, a single line without a newline.
+
+    fields are included in the line in JSON mode, and are ignored
+    otherwise.
+
+    """
+    global _dropped
+    log_queue = _queue
+    if log_queue is None:
+        _emit([format_line(time.time(), message, fields)])
+        return
+    try:
+        log_queue.put_nowait((time.time(), message, fields))
+    except queue.Full:
+        dropped_lines.inc()
+        _dropped_lock.acquire()
+        _dropped += 1
+        _dropped_lock.release()
+
+
+def flush(timeout=5):
+    """Wait until the lines already written have been written out.
+
+    flush waits no more than timeout seconds, so that a process which
+    is exiting isn't held by a stderr or syslog that doesn't accept
+    lines.  It returns False if the lines weren't all written in time.
+
+    """
+    log_queue = _queue
+    if log_queue is None:
+        return True
+    with log_queue.all_tasks_done:
+        return log_queue.all_tasks_done.wait_for(lambda: not log_queue.unfinished_tasks,
+                                                 timeout)
+
+
+def _take_dropped():
+    global _dropped
+    _dropped_lock.acquire()
+    dropped = _dropped
+    _dropped = 0
+    _dropped_lock.release()
+    return dropped
+
+
+def _write_lines(log_queue):
+    while True:
+        entries = [log_queue.get()]
+        while len(entries) < batch_size:
+            try:
+                entries.append(log_queue.get_nowait())
+            except queue.Empty:
+                break
+        lines = [format_line(*x) for x in entries]
+        dropped = _take_dropped()
+        if dropped:
+            lines.append(format_line(time.time(),
+                                     'pythonfilter dropped %d log lines' % dropped,
+                                     {'dropped': dropped}))
+        try:
+            _emit(lines)
+        except Exception:
+            pass
+        for x in entries:
+            log_queue.task_done()
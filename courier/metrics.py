@@ -0,0 +1,264 @@
+# courier.metrics -- python module for reporting pythonfilter's performance
+# Copyright (C) 2003-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+import http.server
+import os
+import socketserver
+import _thread
+
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# Bucket boundaries, in seconds, for filter run times.
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\')
+            .replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    labels = list(zip(labelnames, labelvalues)) + list(extra)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(['%s="%s"' % (x[0], _escape(x[1])) for x in labels])
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return '%d' % value
+    return repr(value)
+
+
+class Metric():
+    """Base class for metrics, which may have labels.
+
+    Values for each combination of labels are stored in the values
+    dictionary, keyed by a tuple of the label values.  If function is
+    given, it is called with no arguments to collect the metric's
+    value when the metric is rendered.  If the metric has labels, the
+    function returns a dictionary in the same form as values.
+
+    """
+    type_name = 'unknown'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self.lock = _thread.allocate_lock()
+        self.values = {}
+
+    def _check_labels(self, labelvalues):
+        if len(labelvalues) != len(self.labelnames):
+            raise ValueError('%s requires labels %s' % (self.name, self.labelnames))
+
+    def get(self, *labelvalues):
+        """Return the value for labelvalues, or None."""
+        if self.function and self.labelnames:
+            return self.function().get(labelvalues)
+        if self.function:
+            return self.function()
+        return self.values.get(labelvalues)
+
+    def samples(self):
+        """Return a list of (suffix, labelvalues, extra labels, value)."""
+        if self.function and self.labelnames:
+            values = self.function()
+            return [('', x, (), values[x]) for x in sorted(values)]
+        if self.function:
+            return [('', (), (), self.function())]
+        self.lock.acquire()
+        try:
+            return [('', x, (), self.values[x]) for x in sorted(self.values)]
+        finally:
+            self.lock.release()
+
+    def render(self):
+        lines = ['# TYPE %s %s' % (self.name, self.type_name),
+                 '# HELP %s %s' % (self.name, _escape(self.documentation))]
+        for (suffix, labelvalues, extra, value) in self.samples():
+            lines.append('%s%s%s %s' % (self.name, suffix,
+                                        _format_labels(self.labelnames, labelvalues, extra),
+                                        _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    """A value which only increases, such as a number of events."""
+    type_name = 'counter'
+
+    def inc(self, *labelvalues, amount=1):
+        self._check_labels(labelvalues)
+        self.lock.acquire()
+        try:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+        finally:
+            self.lock.release()
+
+    def samples(self):
+        return [('_total',) + x[1:] for x in Metric.samples(self)]
+
+
+class Gauge(Metric):
+    """A value which may go up and down, such as a number in progress."""
+    type_name = 'gauge'
+
+    def set(self, value, *labelvalues):
+        self._check_labels(labelvalues)
+        self.lock.acquire()
+        try:
+            self.values[labelvalues] = value
+        finally:
+            self.lock.release()
+
+    def inc(self, *labelvalues, amount=1):
+        self._check_labels(labelvalues)
+        self.lock.acquire()
+        try:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+        finally:
+            self.lock.release()
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Histogram(Metric):
+    """Observations counted in buckets, such as run times.
+
+    The value for each combination of labels is a list of the counts
+    in each bucket, followed by the sum and count of observations.
+
+    """
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=TIME_BUCKETS):
+        Metric.__init__(self, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, *labelvalues):
+        self._check_labels(labelvalues)
+        self.lock.acquire()
+        try:
+            data = self.values.get(labelvalues)
+            if data is None:
+                data = [0] * len(self.buckets) + [0.0, 0]
+                self.values[labelvalues] = data
+            for (i, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-2] += value
+            data[-1] += 1
+        finally:
+            self.lock.release()
+
+    def samples(self):
+        samples = []
+        for (suffix, labelvalues, extra, data) in Metric.samples(self):
+            cumulative = 0
+            for (bound, count) in zip(self.buckets, data):
+                cumulative += count
+                samples.append(('_bucket', labelvalues,
+                                (('le', _format_value(float(bound))),), cumulative))
+            samples.append(('_sum', labelvalues, (), data[-2]))
+            samples.append(('_count', labelvalues, (), data[-1]))
+        return samples
+
+
+class Registry():
+    """A collection of metrics, rendered together in OpenMetrics format."""
+    def __init__(self):
+        self.lock = _thread.allocate_lock()
+        self.metrics = {}
+
+    def register(self, metric):
+        """Add metric to the registry, replacing any with the same name."""
+        self.lock.acquire()
+        self.metrics[metric.name] = metric
+        self.lock.release()
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), function=None):
+        return self.register(Counter(name, documentation, labelnames, function))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=TIME_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        self.lock.acquire()
+        metrics = list(self.metrics.values())
+        self.lock.release()
+        return ''.join([x.render() for x in metrics]) + '# EOF\n'
+
+
+# The registry used by pythonfilter and its filters.
+registry = Registry()
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = self.server.registry.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _TCPMetricsServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class _UnixMetricsServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(address, metrics_registry=None):
+    """Serve the metrics in registry over HTTP in a background thread.
+
+    address may be the path of a UNIX socket, beginning with '/', or
+    'host:port' for a TCP socket.  Any request will receive the
+    metrics.  Returns the server object.
+
+    """
+    if address.startswith('/'):
+        try:
+            os.unlink(address)
+        except OSError:
+            pass
+        server = _UnixMetricsServer(address, _MetricsHandler)
+    else:
+        (host, sep, port) = address.rpartition(':')
+        server = _TCPMetricsServer((host, int(port)), _MetricsHandler)
+    server.registry = metrics_registry or registry
+    _thread.start_new_thread(server.serve_forever, ())
+    return server
@@ -0,0 +1,161 @@
+# courier.predicate -- python module for selecting messages by their details
+# Copyright (C) 2003-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compile predicates which select messages, such as "authenticated".
+
+A predicate is made of the following terms, combined with "and", "or",
+"not" and parentheses:
+
+authenticated -- the sender used SMTP AUTH
+relayed -- the client's address has RELAYCLIENT set in smtpaccess
+sender-local -- the sender's domain is a local domain
+sender-hosted -- the sender's domain is a hosted domain
+rcpt-domain=DOMAIN -- a recipient's address is in DOMAIN
+size>N, size<N -- the message body is larger or smaller than N
+                  bytes.  N may end with "k" or "M".
+
+compile returns a function which takes a courier.context.MessageContext
+and returns True or False.
+
+"""
+
+import os
+import re
+import courier.config
+
+
+class PredicateError(ValueError):
+    """Raised when a predicate can't be parsed."""
+    pass
+
+
+_token_re = re.compile(r'\(|\)|[^\s()]+')
+_size_re = re.compile(r'^size([<>])(\d+)([kM]?)$')
+_size_units = {'': 1, 'k': 1024, 'M': 1024 * 1024}
+
+
+def _sender_domain(context):
+    return context.get_sender().rpartition('@')[2].lower()
+
+
+def _authenticated(context):
+    return context.get_auth_user() is not None
+
+
+def _relayed(context):
+    senders_ip = context.get_senders_ip()
+    return bool(senders_ip and courier.config.is_relayed(senders_ip))
+
+
+def _sender_local(context):
+    domain = _sender_domain(context)
+    return bool(domain and courier.config.is_local(domain))
+
+
+def _sender_hosted(context):
+    domain = _sender_domain(context)
+    return bool(domain and courier.config.is_hosteddomain(domain))
+
+
+_terms = {'authenticated': _authenticated,
+          'relayed': _relayed,
+          'sender-local': _sender_local,
+          'sender-hosted': _sender_hosted}
+
+
+def _compile_term(token):
+    if token in _terms:
+        return _terms[token]
+    if token.startswith('rcpt-domain='):
+        domain = token[len('rcpt-domain='):].lower()
+        if not domain:
+            raise PredicateError('rcpt-domain requires a domain')
+        return lambda context: any([x.rpartition('@')[2].lower() == domain
+                                    for x in context.get_recipients()])
+    match = _size_re.match(token)
+    if match:
+        size = int(match.group(2)) * _size_units[match.group(3)]
+        if match.group(1) == '>':
+            return lambda context: os.path.getsize(context.body_path) > size
+        return lambda context: os.path.getsize(context.body_path) < size
+    raise PredicateError('unknown term "%s"' % token)
+
+
+class _Parser:
+    def __init__(self, text):
+        self.tokens = _token_re.findall(text)
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None
+
+    def next(self):
+        token = self.peek()
+        if token is None:
+            raise PredicateError('unexpected end of predicate')
+        self.position += 1
+        return token
+
+    def parse(self):
+        function = self.parse_or()
+        if self.peek() is not None:
+            raise PredicateError('unexpected "%s"' % self.peek())
+        return function
+
+    def parse_or(self):
+        functions = [self.parse_and()]
+        while self.peek() == 'or':
+            self.next()
+            functions.append(self.parse_and())
+        if len(functions) == 1:
+            return functions[0]
+        return lambda context: any(x(context) for x in functions)
+
+    def parse_and(self):
+        functions = [self.parse_not()]
+        while self.peek() == 'and':
+            self.next()
+            functions.append(self.parse_not())
+        if len(functions) == 1:
+            return functions[0]
+        return lambda context: all(x(context) for x in functions)
+
+    def parse_not(self):
+        token = self.next()
+        if token == 'not':
+            function = self.parse_not()
+            return lambda context: not function(context)
+        if token == '(':
+            function = self.parse_or()
+            if self.next() != ')':
+                raise PredicateError('expected ")"')
+            return function
+        if token in ('and', 'or', ')'):
+            raise PredicateError('unexpected "%s"' % token)
+        return _compile_term(token)
+
+
+def compile(text):
+    """Return a function which evaluates the predicate in text.
+
+    PredicateError is raised if text isn't a valid predicate.
+
+    """
+    return _Parser(text).parse()
@@ -27,6 +27,7 @@ import shutil
 import courier.config
 import courier.control
 import courier.sendmail
+import courier.trace
 import courier.xfilter
 
 
@@ -49,7 +50,7 @@ def _get_db():
     dbmpath = '%s/msgs.db' % config['dir']
     lockpath = '%s/msgs.lock' % config['dir']
     lock = open(lockpath, 'w')
-    fcntl.flock(lock, fcntl.LOCK_EX)
+    courier.trace.blocked('quarantine', fcntl.flock, lock, fcntl.LOCK_EX)
     dbm_file = dbm.open(dbmpath, 'c')
     return(dbm_file, lock)
 
@@ -92,7 +93,7 @@ for further assistance.
     send_notice(message, address)
 
 
-def quarantine(body_path, control_paths, explanation):
+def quarantine(body_path, control_paths, explanation, context=None):
     # Generate an ID for this quarantined message.  The ID will consist
     # of the inode number for the body file.  The inode number from the
     # original body file will be used for the temporary file's name.
@@ -135,8 +136,11 @@ def quarantine(body_path, control_paths, explanation):
     expiration = datetime.date.fromtimestamp(time.time() + (days * 86400)).strftime('%a %B %d, %Y')
     # Parse the message for its sender and subject:
     try:
-        with open(body_path, 'rb') as body_file:
-            qmessage = email.message_from_binary_file(body_file)
+        if context:
+            qmessage = context.get_message()
+        else:
+            with open(body_path, 'rb') as body_file:
+                qmessage = email.message_from_binary_file(body_file)
     except Exception as e:
         # TODO: Handle this error.
         raise #InitError('Internal failure parsing message data file: %s' % str(e))
@@ -167,9 +171,14 @@ Quarantine release address:
            qmessage_subject,
            release_addr)
     # Mark recipients complete and send notices.
-    control_data = courier.control.get_control_data(control_paths)
+    if context:
+        control_data = context.get_control_data()
+    else:
+        control_data = courier.control.get_control_data(control_paths)
+    with courier.control.edit(control_paths) as tx:
+        for x in control_data['r']:
+            tx.del_recipient_data(x)
     for x in control_data['r']:
-        courier.control.del_recipient_data(control_paths, x)
         send_notice(message, x[0])
 
 
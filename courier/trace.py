@@ -0,0 +1,180 @@
+# courier.trace -- python module for tracing where time is spent on messages
+# Copyright (C) 2003-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Record spans of time spent on each message.
+
+When tracing is enabled with open_log, pythonfilter creates a Trace for
+each message, and records the time that the message waited in the
+queue, the wall clock and CPU time of each filter, and the total time.
+Code which may block on a shared lock can use acquire or blocked, which
+record the time spent waiting if the current thread is working on a
+traced message.
+
+Each trace is appended to the log as one line:
+
+  <start time> <message ID> <span>=<wall>[/<cpu>] ...
+
+where each span is named for its phase, such as "queue", or
+"filter:clamav" or "lock:ttldb.greylist", and times are in seconds.
+A span may appear more than once in a line.  summarize reads these
+lines and reports percentiles for each span.
+
+"""
+
+import contextvars
+import os
+import time
+import _thread
+
+
+# The trace of the message being processed by the current thread or
+# coroutine.
+_current = contextvars.ContextVar('courier.trace', default=None)
+
+_log_fd = None
+
+
+class Trace:
+    """The spans recorded for one message."""
+    def __init__(self, start_time=None):
+        self.start_time = start_time or time.time()
+        self.lock = _thread.allocate_lock()
+        self.spans = []
+
+    def add(self, name, wall_time, cpu_time=None):
+        self.lock.acquire()
+        self.spans.append((name, wall_time, cpu_time))
+        self.lock.release()
+
+    def format(self, message_id):
+        self.lock.acquire()
+        spans = list(self.spans)
+        self.lock.release()
+        words = ['%.6f' % self.start_time, message_id or '-']
+        for (name, wall_time, cpu_time) in spans:
+            if cpu_time is None:
+                words.append('%s=%.6f' % (name, wall_time))
+            else:
+                words.append('%s=%.6f/%.6f' % (name, wall_time, cpu_time))
+        return ' '.join(words) + '\n'
+
+
+def open_log(path):
+    """Enable tracing, and append traces to the file at path."""
+    global _log_fd
+    _log_fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+
+
+def start(start_time=None):
+    """Return a new Trace if tracing is enabled, or None."""
+    if _log_fd is None:
+        return None
+    return Trace(start_time)
+
+
+def write(trace, message_id):
+    """Append trace to the log."""
+    # A single write to a file opened for appending isn't interleaved
+    # with writes from other threads or processes.
+    os.write(_log_fd, trace.format(message_id).encode())
+
+
+def activate(trace):
+    """Make trace the current trace, and return a token for deactivate."""
+    return _current.set(trace)
+
+
+def deactivate(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+def blocked(name, function, *args):
+    """Call function, recording the time it takes as a lock wait."""
+    trace = _current.get()
+    if trace is None:
+        return function(*args)
+    start_time = time.time()
+    try:
+        return function(*args)
+    finally:
+        trace.add('lock:' + name, time.time() - start_time)
+
+
+def acquire(lock, name):
+    """Acquire lock, recording the time spent waiting for it."""
+    return blocked(name, lock.acquire)
+
+
+def parse(line):
+    """Return the start time, message ID, and spans from a line of the log.
+
+    Each span is a tuple of its name, wall time, and CPU time or None.
+
+    """
+    words = line.split()
+    spans = []
+    for word in words[2:]:
+        (name, equals, times) = word.rpartition('=')
+        (wall_time, slash, cpu_time) = times.partition('/')
+        spans.append((name, float(wall_time), float(cpu_time) if cpu_time else None))
+    return (float(words[0]), words[1], spans)
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile of a sorted list of values."""
+    index = max(0, min(len(values) - 1, int(round(fraction * len(values))) - 1))
+    return values[index]
+
+
+def summarize(lines, fractions=(0.5, 0.9, 0.99)):
+    """Return statistics for each span name in lines of the log.
+
+    The result is a dictionary, keyed by span name, of dictionaries
+    with the number of messages in which the span appeared ('count'),
+    the percentiles of its wall clock time, keyed by fraction, and the
+    mean CPU time ('cpu'), or None if it wasn't measured.  Spans which
+    appear more than once for one message are added together.
+
+    """
+    wall_times = {}
+    cpu_times = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        (start_time, message_id, spans) = parse(line)
+        message_wall = {}
+        for (name, wall_time, cpu_time) in spans:
+            message_wall[name] = message_wall.get(name, 0.0) + wall_time
+            if cpu_time is not None:
+                cpu_times.setdefault(name, []).append(cpu_time)
+        for (name, wall_time) in message_wall.items():
+            wall_times.setdefault(name, []).append(wall_time)
+    summary = {}
+    for (name, values) in wall_times.items():
+        values.sort()
+        stats = {'count': len(values), 'cpu': None}
+        for fraction in fractions:
+            stats[fraction] = percentile(values, fraction)
+        if name in cpu_times:
+            stats['cpu'] = sum(cpu_times[name]) / len(cpu_times[name])
+        summary[name] = stats
+    return summary
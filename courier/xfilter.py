@@ -50,10 +50,16 @@ class XFilter:
     filter_name -- a name identifying the filter calling this class
     body_path -- the same argument given to the doFilter function
     control_paths -- the same argument given to the doFilter function
+    context -- the courier.context.MessageContext given to the filter,
+               if it has one
 
     The class will raise xfilter.InitError when instantiated if it
     cannot open the body_path or any of the control files.
 
+    If a context is given, the message is copied from the context
+    rather than parsed again, and the context's message is replaced
+    when the new message is submitted.
+
     After creating an instance of this class, use the get_message
     method to get the email.Message object created from the body_path.
     Make any modifications required using the normal python functions
@@ -63,20 +69,32 @@ class XFilter:
     method to insert the new message into the spool.
 
     """
-    def __init__(self, filter_name, body_path, control_paths):
+    def __init__(self, filter_name, body_path, control_paths, context=None):
+        self.message = None
         try:
-            with open(body_path, 'rb') as body_file:
-                self.message = email.message_from_binary_file(body_file)
+            if context:
+                # The copy is made only if the filter asks for the
+                # message, since it may replace it instead.
+                context.get_message()
+            else:
+                with open(body_path, 'rb') as body_file:
+                    self.message = email.message_from_binary_file(body_file)
         except Exception as e:
             raise InitError('Internal failure parsing message data file: %s' % str(e))
         # Save the arguments
         self.filter_name = filter_name
         self.body_path = body_path
         self.control_paths = control_paths
+        self.context = context
         # Parse the control files and save their data
-        self.control_data = courier.control.get_control_data(control_paths)
+        if context:
+            self.control_data = context.get_control_data()
+        else:
+            self.control_data = courier.control.get_control_data(control_paths)
 
     def get_message(self):
+        if self.message is None:
+            self.message = self.context.copy_message()
         return self.message
 
     def set_message(self, message):
@@ -89,7 +107,7 @@ class XFilter:
         bfo = open(self.body_path, 'r+b')
         bfo.truncate(0)
         g = email.generator.BytesGenerator(bfo, mangle_from_=False)
-        g.flatten(self.message)
+        g.flatten(self.get_message())
         # Make sure that the file ends with a newline, or courier
         # will choke on the new message file.
         bfo.seek(0, 2)
@@ -98,6 +116,9 @@ class XFilter:
             bfo.seek(0, 2)
             bfo.write(b'\n')
         bfo.close()
+        # Filters that run after this one will see the new message.
+        if self.context:
+            self.context.set_message(self.message)
         return ''
 
     # Deprecated names preserved for compatibility with older releases
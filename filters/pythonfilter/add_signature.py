@@ -24,7 +24,7 @@ import email.charset
 import email.generator
 import email.mime.multipart
 import email.mime.text
-import courier.control
+import courier.context
 import courier.xfilter
 
 
@@ -44,8 +44,10 @@ def init_filter():
     sys.stderr.write('Initialized the "add_signature" python filter\n')
 
 
-def do_filter(body_path, control_paths):
-    sender = courier.control.get_auth_user(control_paths, body_path)
+def do_filter(body_path, control_paths, context=None):
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
+    sender = context.get_auth_user()
     if not sender:
         return ''
     sender_bits = sender.split('@')
@@ -59,7 +61,7 @@ def do_filter(body_path, control_paths):
     email.charset.add_charset('utf-8', email.charset.SHORTEST, email.charset.QP, None)
     # Load the message from the body_path
     mfilter = courier.xfilter.XFilter('add_signature',
-                                      body_path, control_paths)
+                                      body_path, control_paths, context)
     original = mfilter.getMessage()
     # Create a new message object
     msg = email.mime.multipart.MIMEMultipart('mixed')
@@ -23,6 +23,7 @@ import re
 import email.header
 import tempfile
 import courier.config
+import courier.context
 try:
     import libarchive
     HAVE_LIBARCHIVE = True
@@ -30,6 +31,9 @@ except ImportError:
     HAVE_LIBARCHIVE = False
 
 
+parallel_safe = True
+
+
 blocked_pattern = re.compile(r'^.*\.(scr|exe|com|bat|pif|lnk|sys|mid|vb|js|ws|shs|ceo|cmd|cpl|hta|vbs)$', re.I)
 
 
@@ -64,10 +68,11 @@ def check_archive(filename, part):
     os.rmdir(tmp_d)
     return found
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
     try:
-        with open(body_path, 'rb') as body_file:
-            msg = email.message_from_binary_file(body_file)
+        msg = context.get_message()
     except Exception as e:
         return "554 " + str(e)
 
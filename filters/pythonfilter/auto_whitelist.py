@@ -21,7 +21,7 @@ import hashlib
 import sys
 import time
 import courier.config
-import courier.control
+import courier.context
 from . import ttldb
 
 
@@ -45,12 +45,12 @@ def init_filter():
     sys.stderr.write('Initialized the "auto_whitelist" python filter\n')
 
 
-def whitelist_recipients(control_paths):
-    sender = courier.control.get_sender(control_paths).lower()
+def whitelist_recipients(context):
+    sender = context.get_sender().lower()
     sender_md5 = hashlib.md5(sender.encode())
     _whitelist.lock()
     try:
-        for recipient in courier.control.get_recipients(control_paths):
+        for recipient in context.get_recipients():
             recipient = recipient.lower()
             # Don't allow a whitelist between identical addresses.  Users
             # sometimes email themselves a note, which creates a path for
@@ -65,12 +65,12 @@ def whitelist_recipients(control_paths):
         _whitelist.unlock()
 
 
-def check_whitelist(control_paths):
+def check_whitelist(context):
     found_all = 1
-    sender = courier.control.get_sender(control_paths).lower()
+    sender = context.get_sender().lower()
     _whitelist.lock()
     try:
-        for recipient in courier.control.get_recipients(control_paths):
+        for recipient in context.get_recipients():
             correspondents = hashlib.md5(recipient.lower().encode())
             correspondents.update(sender.encode())
             cdigest = correspondents.hexdigest()
@@ -82,7 +82,7 @@ def check_whitelist(control_paths):
     return found_all
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Return a 200 code if the message looks like a reply to a message
     sent by an authenticated user.
 
@@ -92,12 +92,14 @@ def do_filter(body_path, control_paths):
 
     """
 
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
     _whitelist.purge()
-    auth_user = courier.control.get_auth_user(control_paths, body_path)
+    auth_user = context.get_auth_user()
     if auth_user:
-        whitelist_recipients(control_paths)
+        whitelist_recipients(context)
         return ''
-    if check_whitelist(control_paths):
+    if check_whitelist(context):
         return '200 Ok'
     # Return no decision for everyone else.
     return ''
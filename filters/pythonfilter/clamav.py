@@ -19,6 +19,7 @@
 # along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
+import courier.breaker
 import courier.config
 import courier.quarantine
 import pyclamd
@@ -26,37 +27,53 @@ import pyclamd
 local_socket = None
 action = 'reject'
 
+# Quarantining a message modifies its control files, so the filter can
+# only run in parallel with others when it rejects viruses.
+parallel_safe = True
 
-def scan_message(body_path, control_paths):
+# The circuit breaker for clamd is created by init_filter.
+clamd_breaker = None
+
+
+def scan_message(body_path, control_paths, context=None):
     try:
         clamd = pyclamd.ClamdUnixSocket(local_socket)
-        avresult = clamd.scan_file(body_path)
-    except pyclamd.ConnectionError as e:
+        avresult = clamd_breaker.call(clamd.scan_file, body_path)
+    except (pyclamd.ConnectionError, courier.breaker.CircuitOpenError) as e:
         return "430 Virus scanner error: " + str(e)
     if avresult is not None and body_path in avresult:
         if avresult[body_path][0] == 'FOUND':
-            return handle_virus(body_path, control_paths, avresult[body_path][1])
+            return handle_virus(body_path, control_paths,
+                                avresult[body_path][1], context)
         return "430 Virus scanner error: " + avresult[body_path][1]
     return ''
 
 
-def handle_virus(body_path, control_paths, virus_signature):
+def handle_virus(body_path, control_paths, virus_signature, context=None):
     if action == 'reject':
         return "554 Virus found - Signature is %s" % virus_signature
     courier.quarantine.quarantine(body_path, control_paths,
-                                  'The virus %s was found in the message' % virus_signature)
+                                  'The virus %s was found in the message' % virus_signature,
+                                  context)
     return '050 OK'
 
 
+def ping_clamd():
+    pyclamd.ClamdUnixSocket(local_socket).ping()
+
+
 def init_filter():
     courier.config.apply_module_config('clamav.py', globals())
     courier.quarantine.init()
+    global parallel_safe, clamd_breaker
+    parallel_safe = (action == 'reject')
+    clamd_breaker = courier.breaker.get_breaker('clamd', ping_clamd)
     # Record in the system log that this filter was initialized.
     sys.stderr.write('Initialized the "clamav" python filter\n')
 
 
-def do_filter(body_path, control_paths):
-    return scan_message(body_path, control_paths)
+def do_filter(body_path, control_paths, context=None):
+    return scan_message(body_path, control_paths, context)
 
 
 if __name__ == '__main__':
@@ -21,7 +21,7 @@ import hashlib
 import sys
 import time
 import courier.config
-import courier.control
+import courier.context
 from . import ttldb
 
 
@@ -45,7 +45,7 @@ def init_filter():
     sys.stderr.write('Initialized the "comeagain" python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Return a temporary failure message if this sender hasn't tried to
     deliver mail previously.
 
@@ -58,9 +58,11 @@ def do_filter(body_path, control_paths):
 
     """
 
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
     # Grab the sender from the control files.
     try:
-        sender = courier.control.get_sender(control_paths)
+        sender = context.get_sender()
     except Exception:
         return '451 Internal failure locating control files'
     if sender == '':
@@ -80,7 +82,7 @@ def do_filter(body_path, control_paths):
     found_all = 1
     _senders.lock()
     try:
-        for recipient in courier.control.get_recipients(control_paths):
+        for recipient in context.get_recipients():
             correspondents = sender_md5.copy()
             correspondents.update(recipient.encode())
             cdigest = correspondents.hexdigest()
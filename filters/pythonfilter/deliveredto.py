@@ -17,9 +17,12 @@
 # You should have received a copy of the GNU General Public License
 # along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
 
-import email
 import sys
 import courier.config
+import courier.context
+
+
+parallel_safe = True
 
 
 def init_filter():
@@ -27,16 +30,17 @@ def init_filter():
     sys.stderr.write('Initialized the "deliveredto" python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Check 'Delivered-to' header
 
     Reject messages if the Delivered-to header indicates a
     locally hosted domain.
 
     """
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
     try:
-        with open(body_path, 'rb') as body_file:
-            message = email.message_from_binary_file(body_file)
+        message = context.get_message()
     except:
         return '451 Internal failure parsing message data file'
     if 'Delivered-To' in message:
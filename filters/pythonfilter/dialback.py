@@ -24,9 +24,13 @@ import sys
 import time
 import DNS
 import courier.config
+import courier.context
 from . import ttldb
 
 
+parallel_safe = True
+
+
 # The good/bad senders lists will be scrubbed at the interval indicated
 # in seconds.  All records older than the "TTL" number of seconds
 # will be removed from the lists.
@@ -62,7 +66,7 @@ def init_filter():
     sys.stderr.write('Initialized the dialback python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Contact the MX for this message's sender and validate their address.
 
     Validation will be done by starting an SMTP session with the MX and
@@ -70,9 +74,11 @@ def do_filter(body_path, control_paths):
 
     """
 
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
     # Grab the sender from the control files.
     try:
-        sender = courier.control.get_sender(control_paths)
+        sender = context.get_sender()
     except:
         return '451 Internal failure locating control files'
     if sender == '':
@@ -140,9 +146,9 @@ def do_filter(body_path, control_paths):
     filter_reply = '421 No SMTP servers were available to authenticate sender'
 
     for mx in mx_list:
-        # Create an SMTP instance.  If the dialback thread takes
-        # too long, we'll close its socket.
-        smtpi = smtplib.SMTP()
+        # Create an SMTP instance.  If the server takes too long to
+        # respond, the connection will time out after smtp_timeout.
+        smtpi = smtplib.SMTP(timeout=smtp_timeout)
         try:
             smtpi.connect(mx[1])
         except:
@@ -24,7 +24,7 @@ import ipaddress
 import sys
 import time
 import courier.config
-import courier.control
+import courier.context
 from . import ttldb
 
 
@@ -58,7 +58,7 @@ def init_filter():
     sys.stderr.write('Initialized the "greylist" python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Return a temporary failure message if this sender hasn't tried to
     deliver mail previously.
 
@@ -74,7 +74,9 @@ def do_filter(body_path, control_paths):
 
     """
 
-    senders_ip = ipaddress.ip_address(courier.control.get_senders_ip(control_paths)).exploded
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
+    senders_ip = ipaddress.ip_address(context.get_senders_ip()).exploded
     if '.' in senders_ip:
         # For IPv4, use the first three octets
         senders_ip_network = senders_ip[:senders_ip.rindex('.')]
@@ -84,7 +86,7 @@ def do_filter(body_path, control_paths):
 
     # Grab the sender from the control files.
     try:
-        sender = courier.control.get_sender(control_paths)
+        sender = context.get_sender()
     except:
         return '451 Internal failure locating control files'
     if sender == '':
@@ -112,7 +114,7 @@ def do_filter(body_path, control_paths):
     found_all = 1
     biggest_time_to_go = 0
 
-    for recipient in courier.control.get_recipients(control_paths):
+    for recipient in context.get_recipients():
         recipient = recipient.lower()
 
         correspondents = sender_md5.copy()
@@ -20,7 +20,10 @@
 import sys
 import courier.authdaemon
 import courier.config
-import courier.control
+import courier.context
+
+
+parallel_safe = True
 
 
 require_auth = False
@@ -32,10 +35,12 @@ def init_filter():
     sys.stderr.write('Initialized the "localsenders" python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Validate sender addresses, if their domain is locally hosted."""
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
     try:
-        sender = courier.control.get_sender(control_paths)
+        sender = context.get_sender()
     except:
         return '451 Internal failure locating control files'
     sparts = sender.split('@')
@@ -53,7 +58,7 @@ def do_filter(body_path, control_paths):
     if sender_info is None:
         return '517 Sender does not exist: %s' % sender
     if(require_auth and
-       courier.control.get_auth_user(control_paths, body_path) is None):
+       context.get_auth_user() is None):
         return '517 Policy requires local senders to authenticate.'
     return ''
 
@@ -18,7 +18,8 @@
 # along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
-import courier.control
+import courier.context
+import courier.log
 
 
 def init_filter():
@@ -26,11 +27,13 @@ def init_filter():
     sys.stderr.write('Initialized the "log_aliases" python filter\n')
 
 
-def do_filter(body_path, control_paths):
-    for addr in courier.control.get_recipients_data(control_paths):
+def do_filter(body_path, control_paths, context=None):
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
+    for addr in context.get_recipients_data():
         if addr[1]:
             if addr[1].startswith('rfc822;'):
                 addr[1] = addr[1][7:]
-            sys.stderr.write('Message delivered to %s was originally addressed to %s.\n' %
-                             (addr[0], addr[1]))
+            courier.log.write('Message delivered to %s was originally addressed to %s.' %
+                              (addr[0], addr[1]), recipient=addr[0], original=addr[1])
     return ''
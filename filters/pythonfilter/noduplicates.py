@@ -18,7 +18,9 @@
 # along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
+import courier.context
 import courier.control
+import courier.log
 
 
 def init_filter():
@@ -26,20 +28,24 @@ def init_filter():
     sys.stderr.write('Initialized the "noduplicates" python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Remove duplicate addresses control_paths
 
     Courier will duplicate canonical addresses if their original
     address differed.
 
     """
-    rcpts = courier.control.get_recipients_data(control_paths)
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
+    rcpts = context.get_recipients_data()
     rdups = {}
-    for x in rcpts:
-        if x[0] in rdups:
-            sys.stderr.write('noduplicates filter: Removing duplicate address "%s" from control file.\n' % x[0])
-            courier.control.del_recipient_data(control_paths, x)
-        rdups[x[0]] = 1
+    with courier.control.edit(control_paths) as tx:
+        for x in rcpts:
+            if x[0] in rdups:
+                courier.log.write('noduplicates filter: Removing duplicate address "%s" from control file.' % x[0],
+                                  recipient=x[0])
+                tx.del_recipient_data(x)
+            rdups[x[0]] = 1
     # Return no decision.
     return ''
 
@@ -18,7 +18,7 @@
 # along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
-import courier.control
+import courier.context
 import courier.xfilter
 
 
@@ -27,13 +27,15 @@ def init_filter():
     sys.stderr.write('Initialized the "noreceivedheaders" python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Remove the Received header if the sender authenticated himself."""
-    auth_user = courier.control.get_auth_user(control_paths, body_path)
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
+    auth_user = context.get_auth_user()
     if auth_user is None:
         return ''
     mfilter = courier.xfilter.XFilter('noreceivedheaders', body_path,
-                                      control_paths)
+                                      control_paths, context)
     mmsg = mfilter.getMessage()
     del mmsg['Received']
     submit_val = mfilter.submit()
@@ -18,6 +18,7 @@
 # along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
+import courier.context
 import courier.control
 
 
@@ -26,7 +27,7 @@ def init_filter():
     sys.stderr.write('Initialized the "nosuccessdsn" python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Remove success DSNs from the control_paths
 
     Success DSNs are requested by some spammers with invalid return
@@ -37,13 +38,16 @@ def do_filter(body_path, control_paths):
     deliveries.  If so, enable this filter.
 
     """
-    rcpts = courier.control.get_recipients_data(control_paths)
-    for x in rcpts:
-        if 'S' in x[2]:
-            newrcpt = x[:]
-            newrcpt[2] = ''
-            courier.control.add_recipient_data(control_paths, newrcpt)
-            courier.control.del_recipient_data(control_paths, x)
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
+    rcpts = context.get_recipients_data()
+    with courier.control.edit(control_paths) as tx:
+        for x in rcpts:
+            if 'S' in x[2]:
+                newrcpt = x[:]
+                newrcpt[2] = ''
+                tx.add_recipient_data(newrcpt)
+                tx.del_recipient_data(x)
     # Return no decision.
     return ''
 
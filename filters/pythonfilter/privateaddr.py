@@ -20,7 +20,10 @@
 import sys
 import re
 import courier.config
-import courier.control
+import courier.context
+
+
+parallel_safe = True
 
 
 # private_rcpts is a list of addresses which should only accept
@@ -52,9 +55,11 @@ def init_filter():
     sys.stderr.write('Initialized the "privateaddr" python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Refuse mail if recipient is private, and sender is not approved."""
-    for addr in courier.control.get_recipients_data(control_paths):
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
+    for addr in context.get_recipients_data():
         if addr[1]:
             if addr[1].startswith('rfc822;'):
                 rcpt = addr[1][7:]
@@ -66,7 +71,7 @@ def do_filter(body_path, control_paths):
             rcpt = rcpt.lower()
         if rcpt in private_rcpts:
             sender_allowed = 0
-            sender = courier.control.get_sender(control_paths)
+            sender = context.get_sender()
             for pattern in private_rcpts[rcpt]:
                 if _private_re[pattern].match(sender):
                     sender_allowed = 1
@@ -21,7 +21,10 @@ import os
 import sys
 import courier.authdaemon
 import courier.config
-import courier.control
+import courier.context
+
+
+parallel_safe = True
 
 
 def parse_quota(quota):
@@ -73,9 +76,11 @@ def init_filter():
     sys.stderr.write('Initialized the "quota" python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Reject mail if any recipient is over quota"""
-    rcpts = courier.control.get_recipients_data(control_paths)
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
+    rcpts = context.get_recipients_data()
     for x in rcpts:
         (user, domain) = x[0].split('@', 1)
         if courier.config.is_local(domain):
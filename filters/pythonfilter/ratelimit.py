@@ -21,8 +21,8 @@ import ipaddress
 import sys
 import time
 import _thread
-import courier.control
 import courier.config
+import courier.context
 
 
 # The rate is measured in messages / interval in minutes
@@ -54,14 +54,16 @@ def init_filter():
     sys.stderr.write('Initialized the ratelimit python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Track the number of connections from each IP and temporarily fail
     if there have been too many."""
 
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
     global _senders_last_purged
 
     try:
-        sender = courier.control.get_senders_ip(control_paths)
+        sender = context.get_senders_ip()
         # limit_network might mangle "sender," so save a copy
         esender = sender
     except:
@@ -22,8 +22,8 @@
 import sys
 import time
 import _thread
-import courier.control
 import courier.config
+import courier.context
 
 
 # The rate is measured in messages / interval in minutes
@@ -52,14 +52,16 @@ def init_filter():
     sys.stderr.write('Initialized the ratelimitauth python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Track the number of connections from each sender and temporarily fail
     if there have been too many."""
 
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
     global _senders_last_purged
 
     try:
-        sender = courier.control.get_auth_user(control_paths)
+        sender = context.get_auth_user()
     except:
         return '451 Internal failure locating control files'
     if not sender:
@@ -17,11 +17,10 @@
 # You should have received a copy of the GNU General Public License
 # along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
 
-import email
 import email.utils
 import sys
 import courier.config
-import courier.control
+import courier.context
 import courier.sendmail
 
 
@@ -34,24 +33,25 @@ def init_filter():
     sys.stderr.write('Initialized the "sentfolder" python filter\n')
 
 
-def do_filter(body_path, control_paths):
-    sender = courier.control.get_auth_user(control_paths, body_path)
+def do_filter(body_path, control_paths, context=None):
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
+    sender = context.get_auth_user()
     if not sender:
         return ''
 
     if '@' not in sender:
         sender = '%s@%s' % (sender, courier.config.me())
-    courier.sendmail.sendmail('', sender, makemsg(body_path, control_paths))
+    courier.sendmail.sendmail('', sender, makemsg(body_path, context))
 
     return ''
 
 
-def makemsg(body_path, control_paths):
+def makemsg(body_path, context):
     yield ('X-Deliver-To-Sent-Folder: ' + siteid + '\r\n').encode()
 
     try:
-        with open(body_path, 'rb') as body_file:
-            msg = email.message_from_binary_file(body_file)
+        msg = context.get_message()
     except Exception as e:
         raise SystemError('Internal failure parsing message data file: %s' % str(e))
     tos = msg.get_all('to', [])
@@ -60,7 +60,7 @@ def makemsg(body_path, control_paths):
     resent_ccs = msg.get_all('resent-cc', [])
     all_recipients = [x[1] for x in email.utils.getaddresses(tos + ccs + resent_tos + resent_ccs)]
     bccs = []
-    for recipient in courier.control.get_recipients_data(control_paths):
+    for recipient in context.get_recipients_data():
         if recipient[1]:
             r = recipient[1]
         else:
@@ -21,6 +21,7 @@ import email
 import os.path
 import subprocess
 import sys
+import courier.breaker
 import courier.config
 import courier.xfilter
 
@@ -37,10 +38,27 @@ username = None
 # header will be used to determine whether or not to reject the message.
 # Otherwise, messages will be rejected if they are spam.
 reject_score = None
+# The reply used when spamc can't reach spamd.  The default asks the
+# sender to try again later.  '' accepts the message without scanning it.
+unavailable_reply = '454 Spam scanner unavailable, try again later'
+
+# spamc exits with a status of EX_USAGE or greater if it fails.
+EX_USAGE = 64
+
+# The circuit breaker for spamd is created by init_filter.
+spamd_breaker = None
+
+
+def ping_spamd():
+    status = subprocess.call([spamc_path, '-K'], stdout=subprocess.DEVNULL)
+    if status != 0:
+        raise IOError('spamc -K exited with status %d' % status)
 
 
 def init_filter():
+    global spamd_breaker
     courier.config.apply_module_config('spamassassin.py', globals())
+    spamd_breaker = courier.breaker.get_breaker('spamd', ping_spamd)
     # Record in the system log that this filter was initialized.
     sys.stderr.write('Initialized the "spamassasinfilter" python filter\n')
 
@@ -67,33 +85,50 @@ def check_reject_condition(status, result_header):
     return None
 
 
-def do_filter(body_path, control_paths):
+def run_spamc(body_path):
+    """Return the exit status of spamc and the message that it returns.
+
+    IOError is raised if spamc fails to scan the message.
+
+    """
+    # With -x, spamc reports errors instead of returning the message
+    # unscanned, so that the breaker can count them.
+    cmd = [spamc_path, '-s', str(max_msg_size), '-E', '-x']
+    if username:
+        cmd.extend(['-u', username])
+    with open(body_path, 'r') as body_file:
+        spamc_proc = subprocess.Popen(cmd, stdin=body_file,
+                                      stdout=subprocess.PIPE)
+    # Parse the output of spamc into an email.message object.
+    result = email.message_from_binary_file(spamc_proc.stdout)
+    status = spamc_proc.wait()
+    if status >= EX_USAGE:
+        raise IOError('spamc failed with status %d' % status)
+    return (status, result)
+
+
+def do_filter(body_path, control_paths, context=None):
     msg_size = os.path.getsize(body_path)
     if msg_size > max_msg_size:
         return ''
 
-    cmd = [spamc_path, '-s', str(max_msg_size), '-E']
-    if username:
-        cmd.extend(['-u', username])
     try:
-        with open(body_path, 'r') as body_file:
-            spamc_proc = subprocess.Popen(cmd, stdin=body_file,
-                                          stdout=subprocess.PIPE)
+        (status, result) = spamd_breaker.call(run_spamc, body_path)
+    except courier.breaker.CircuitOpenError:
+        return unavailable_reply
     except Exception as e:
-        return "454 " + str(e)
-
-    # Parse the output of spamc into an email.message object.
-    result = email.message_from_binary_file(spamc_proc.stdout)
+        sys.stderr.write('spamassassin filter: %s\n' % e)
+        return unavailable_reply
     result_header = result['X-Spam-Status']
 
-    reject_msg = check_reject_condition(spamc_proc.wait(), result_header)
+    reject_msg = check_reject_condition(status, result_header)
     if reject_msg is not None:
         return reject_msg
 
     # If the message wasn't rejected, then replace the message with
     # the output of spamc.
     mfilter = courier.xfilter.XFilter('spamassassin', body_path,
-                                      control_paths)
+                                      control_paths, context)
     mfilter.set_message(result)
     submit_val = mfilter.submit()
     return submit_val
@@ -17,9 +17,12 @@
 # You should have received a copy of the GNU General Public License
 # along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import time
+import weakref
 import _thread
 import courier.config
+import courier.trace
 
 
 class TtlDbError(Exception):
@@ -60,6 +63,7 @@ class TtlDbSQL:
 
     def __init__(self, name, ttl, purge_interval):
         self.db_lock = _thread.allocate_lock()
+        self.trace_name = 'ttldb.' + name
 
         if self.dbapi_name is None:
             raise OpenError('Do not use TtlDbSQL directly.  Subclass and define "dbapi".')
@@ -71,6 +75,7 @@ class TtlDbSQL:
             self.paramstyle = self.dbapi.paramstyle
         self.tablename = name
         self._connect()
+        self.pid = os.getpid()
         # The db will be scrubbed at the interval indicated in seconds.
         # All records older than the "ttl" number of seconds will be
         # removed from the db.
@@ -111,6 +116,11 @@ class TtlDbSQL:
             elif(self.paramstyle == 'pyformat'
                  or self.paramstyle == 'named'):
                 exec_params = dict(params)
+        # Don't share a connection inherited from a parent process when
+        # pythonfilter runs multiple worker processes.
+        if self.pid != os.getpid():
+            self._connect()
+            self.pid = os.getpid()
         try:
             c = self.db.cursor()
             c.execute(query, exec_params)
@@ -141,7 +151,7 @@ class TtlDbSQL:
         c.close()
 
     def lock(self):
-        self.db_lock.acquire()
+        courier.trace.acquire(self.db_lock, self.trace_name)
 
     def unlock(self):
         """Unlock the database"""
@@ -235,20 +245,43 @@ class TtlDbMySQL(TtlDbPsycopg2):
             c.close()
 
 
+class _DbmFile:
+    def __init__(self, db):
+        self.db = db
+        self.lock = _thread.allocate_lock()
+
+
+# Each dbm file is opened once, and shared by TtlDbDbm instances with
+# the same name, since dbm files can't be opened more than once for
+# writing.  Filters create new instances when pythonfilter reloads them.
+# The file is closed when no instances remain.
+_dbm_files = weakref.WeakValueDictionary()
+_dbm_files_lock = _thread.allocate_lock()
+
+
 class TtlDbDbm:
     """Wrapper for dbm containing tokens with a TTL."""
     def __init__(self, name, ttl, purge_interval):
-        self.db_lock = _thread.allocate_lock()
-
         import dbm
+        self.trace_name = 'ttldb.' + name
         dbm_config = courier.config.get_module_config('ttldb')
         dbm_dir = dbm_config['dir']
+        dbm_path = dbm_dir + '/' + name
+        _dbm_files_lock.acquire()
         try:
-            self.db = dbm.open(dbm_dir + '/' + name, 'c')
-        except:
-            raise OpenError('Failed to open %s db in %s, ' \
-                            'make sure that the directory exists\n'
-                            % (name, dbm_dir))
+            self.dbm_file = _dbm_files.get(dbm_path)
+            if self.dbm_file is None:
+                try:
+                    self.dbm_file = _DbmFile(dbm.open(dbm_path, 'c'))
+                except:
+                    raise OpenError('Failed to open %s db in %s, ' \
+                                    'make sure that the directory exists\n'
+                                    % (name, dbm_dir))
+                _dbm_files[dbm_path] = self.dbm_file
+            self.db = self.dbm_file.db
+            self.db_lock = self.dbm_file.lock
+        finally:
+            _dbm_files_lock.release()
         # The db will be scrubbed at the interval indicated in seconds.
         # All records older than the "ttl" number of seconds will be
         # removed from the db.
@@ -260,7 +293,7 @@ class TtlDbDbm:
         self.last_purged = 0
 
     def lock(self):
-        self.db_lock.acquire()
+        courier.trace.acquire(self.db_lock, self.trace_name)
 
     def unlock(self):
         """Unlock the database"""
@@ -306,6 +339,18 @@ class TtlDbDbm:
         del self.db[key]
 
 
+def open_dbm_files():
+    """Return the paths of the dbm files that TtlDb instances have open.
+
+    dbm files can't safely be written by more than one process.
+    """
+    _dbm_files_lock.acquire()
+    try:
+        return sorted(_dbm_files.keys())
+    finally:
+        _dbm_files_lock.release()
+
+
 _dbm_classes = {'dbm': TtlDbDbm,
                 'psycopg2': TtlDbPsycopg2,
                 'pg': TtlDbPg,
@@ -18,7 +18,10 @@
 # along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
-import courier.control
+import courier.context
+
+
+parallel_safe = True
 
 
 def init_filter():
@@ -26,7 +29,7 @@ def init_filter():
     sys.stderr.write('Initialized the "whitelist_auth" python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Return a 200 code if the sender appears to have authenticated.
 
     Courier does not currently contain this information in its control
@@ -38,7 +41,9 @@ def do_filter(body_path, control_paths):
 
     """
 
-    auth_user = courier.control.get_auth_user(control_paths, body_path)
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
+    auth_user = context.get_auth_user()
     if auth_user:
         return '200 Ok'
     # Return no decision for everyone else.
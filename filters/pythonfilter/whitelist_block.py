@@ -18,8 +18,11 @@
 # along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
-import courier.control
 import courier.config
+import courier.context
+
+
+parallel_safe = True
 
 
 def init_filter():
@@ -27,7 +30,7 @@ def init_filter():
     sys.stderr.write('Initialized the "whitelist_block" python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Whitelist messages based on smtpaccess.dat.
 
     The smtpaccess.dat file is checked for a BLOCK value.  If one
@@ -37,8 +40,10 @@ def do_filter(body_path, control_paths):
 
     """
 
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
     try:
-        senders_ip = courier.control.get_senders_ip(control_paths)
+        senders_ip = context.get_senders_ip()
     except:
         return '451 Internal failure locating control files'
 
@@ -19,20 +19,48 @@
 
 import sys
 import socket
-import courier.control
+import courier.breaker
 import courier.config
+import courier.context
+
+
+parallel_safe = True
 
 
 dnswl_zone = ['list.dnswl.org']
 
+# The circuit breaker for the DNS resolver is created by init_filter.
+dns_breaker = None
+
+
+def lookup(name):
+    """Return the address of name, or None if it doesn't exist.
+
+    socket.gaierror is raised if the resolver fails.
+
+    """
+    try:
+        return socket.gethostbyname(name)
+    except socket.gaierror as e:
+        if e.errno == socket.EAI_AGAIN:
+            raise
+        return None
+
+
+def probe_resolver():
+    # The DNSWL test entry, 127.0.0.2, only needs to be answered.
+    lookup('2.0.0.127.%s' % dnswl_zone[0])
+
 
 def init_filter():
+    global dns_breaker
     courier.config.apply_module_config('whitelist_dnswl.py', globals())
+    dns_breaker = courier.breaker.get_breaker('dns', probe_resolver)
     # Record in the system log that this filter was initialized.
     sys.stderr.write('Initialized the "whitelist_dnswl" python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Return a 200 code if the message came from an IP in a DNS whitelist.
 
     After returning a 200 code, the pythonfilter process will
@@ -40,8 +68,10 @@ def do_filter(body_path, control_paths):
 
     """
 
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
     try:
-        senders_ip = courier.control.get_senders_ip(control_paths)
+        senders_ip = context.get_senders_ip()
     except:
         return '451 Internal failure locating control files'
 
@@ -51,10 +81,12 @@ def do_filter(body_path, control_paths):
         octets.reverse()
         octets_r = '.'.join(octets)
         for zone in dnswl_zone:
-            lookup = '%s.%s' % (octets_r, zone)
+            lookup_name = '%s.%s' % (octets_r, zone)
             try:
-                lookup_result = socket.gethostbyname(lookup)
-            except:
+                lookup_result = dns_breaker.call(lookup, lookup_name)
+            except OSError:
+                # Don't whitelist the message if the resolver failed,
+                # or has been failing.
                 lookup_result = None
             if lookup_result:
                 # For now, any result is good enough.
@@ -18,21 +18,26 @@
 # along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
-import courier.control
+import courier.context
 import spf
 
 
+parallel_safe = True
+
+
 def init_filter():
     # Record in the system log that this filter was initialized.
     sys.stderr.write('Initialized the whitelist_spf python filter\n')
 
 
-def do_filter(body_path, control_paths):
+def do_filter(body_path, control_paths, context=None):
     """Use the SPF mechanism to whitelist email."""
+    if context is None:
+        context = courier.context.MessageContext(body_path, control_paths)
     try:
-        senders_mta = courier.control.get_senders_mta(control_paths)
-        senders_ip = courier.control.get_senders_ip(control_paths)
-        sender = courier.control.get_sender(control_paths)
+        senders_mta = context.get_senders_mta()
+        senders_ip = context.get_senders_ip()
+        sender = context.get_sender()
     except:
         return '451 Internal failure locating control files'
 
@@ -18,7 +18,7 @@ setup(name="courier-pythonfilter",
       author_email="gordon@dragonsdawn.net",
       url="https://github.com/gordonmessmer/courier-pythonfilter",
       license="GPL",
-      scripts=['pythonfilter', 'pythonfilter-quarantine', 'dropmsg'],
+      scripts=['pythonfilter', 'pythonfilter-quarantine', 'pythonfilter-trace', 'dropmsg'],
       packages=['courier', 'pythonfilter'],
       package_dir={'pythonfilter': 'filters/pythonfilter'},
       data_files=[('/etc/', ['pythonfilter.conf',
@@ -0,0 +1,77 @@
+#!/usr/bin/python3
+# pythonfilter -- A python framework for Courier global filters
+# Copyright (C) 2007-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+import unittest
+import courier.breaker
+
+
+class TestCourierBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.service_up = True
+        self.calls = 0
+        self.breaker = courier.breaker.Breaker('test', self.probe, failures=3, timeout=0.1)
+
+    def probe(self):
+        if not self.service_up:
+            raise IOError('service is down')
+
+    def service(self, value):
+        self.calls += 1
+        if not self.service_up:
+            raise IOError('service is down')
+        return value
+
+    def testBreaker(self):
+        self.assertEqual(self.breaker.call(self.service, 'ok'), 'ok')
+        self.service_up = False
+        for i in range(3):
+            self.assertRaises(IOError, self.breaker.call, self.service, 'ok')
+        self.assertEqual(self.breaker.state, courier.breaker.OPEN)
+        # The service isn't called while the breaker is open.
+        self.assertRaises(courier.breaker.CircuitOpenError,
+                          self.breaker.call, self.service, 'ok')
+        self.assertEqual(self.calls, 4)
+        self.assertEqual(courier.breaker.breaker_state.get('test'), 2)
+        time.sleep(0.3)
+        self.assertEqual(self.breaker.state, courier.breaker.OPEN)
+        self.service_up = True
+        time.sleep(0.3)
+        self.assertEqual(self.breaker.state, courier.breaker.CLOSED)
+        self.assertEqual(self.breaker.call(self.service, 'ok'), 'ok')
+
+    def testSuccessResets(self):
+        self.service_up = False
+        for i in range(2):
+            self.assertRaises(IOError, self.breaker.call, self.service, 'ok')
+        self.service_up = True
+        self.breaker.call(self.service, 'ok')
+        self.service_up = False
+        for i in range(2):
+            self.assertRaises(IOError, self.breaker.call, self.service, 'ok')
+        self.assertEqual(self.breaker.state, courier.breaker.CLOSED)
+        # Other exceptions aren't failures of the service.
+        self.assertRaises(ValueError, self.breaker.call, int, 'x')
+        self.assertEqual(self.breaker.consecutive_failures, 2)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCourierBreaker)
+    unittest.TextTestRunner(verbosity=2).run(suite)
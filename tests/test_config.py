@@ -87,6 +87,40 @@ class TestCourierConfig(unittest.TestCase):
         self.assertEqual(courier.config.is_local('herald.private.dragonsdawn.net'),
                          False)
 
+    def testIsLocalEntries(self):
+        locals_path = f'{self.tmpdir}/configfiles/locals'
+
+        def write_locals(text):
+            # Replacing the file gives it a new inode.
+            with open(locals_path + '.new', 'w') as locals_file:
+                locals_file.write(text)
+            os.replace(locals_path + '.new', locals_path)
+        # Check the file on every call.
+        interval = courier.config.locals_check_interval
+        courier.config.locals_check_interval = 0
+        self.addCleanup(setattr, courier.config, 'locals_check_interval', interval)
+        write_locals('# comment\n\n!mx.example.com\n.example.com\n'
+                     'example.net\n.example.net\n!www.example.net\n')
+        self.assertFalse(courier.config.is_local('example.com'))
+        self.assertTrue(courier.config.is_local('a.b.example.com'))
+        self.assertFalse(courier.config.is_local('mx.example.com'))
+        self.assertFalse(courier.config.is_local('notexample.com'))
+        self.assertTrue(courier.config.is_local('example.net'))
+        # An exclusion after a matching entry has no effect.
+        self.assertTrue(courier.config.is_local('www.example.net'))
+        # The first matching line wins, even if it is a shorter suffix.
+        write_locals('.example.com\n!a.example.com\n.com\n')
+        self.assertTrue(courier.config.is_local('a.example.com'))
+        write_locals('.com\n!a.example.com\n.example.com\n')
+        self.assertTrue(courier.config.is_local('a.example.com'))
+        write_locals('!a.example.com\n.com\n.example.com\n')
+        self.assertFalse(courier.config.is_local('a.example.com'))
+        self.assertTrue(courier.config.is_local('b.example.com'))
+        # The file is compiled again when it is replaced.
+        write_locals('example.org\n')
+        self.assertFalse(courier.config.is_local('b.example.com'))
+        self.assertTrue(courier.config.is_local('example.org'))
+
     def testIsHosteddomain(self):
         # Deprecated function test
         self.assertEqual(courier.config.isHosteddomain('virtual.private.dragonsdawn.net'),
@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+# pythonfilter -- A python framework for Courier global filters
+# Copyright (C) 2007-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import tempfile
+import unittest
+import courier.context
+import courier.control
+import courier.xfilter
+
+
+class TestCourierContext(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        shutil.copytree(f'{os.path.dirname(__file__)}/queuefiles', f'{self.tmpdir}/queuefiles')
+        self.body_path = f'{self.tmpdir}/queuefiles/data-test1'
+        self.control_paths = [f'{self.tmpdir}/queuefiles/control-duplicate']
+        self.context = courier.context.MessageContext(self.body_path, self.control_paths)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testValues(self):
+        self.assertEqual(self.context.get_sender(),
+                         courier.control.get_sender(self.control_paths))
+        self.assertEqual(self.context.get_senders_ip(), '127.0.0.1')
+        self.assertEqual(self.context.get_auth_user(), None)
+        self.assertEqual(self.context.get_message_id(), '000AF5DB.46B0E301.0000778F')
+        self.assertEqual(self.context.get_recipients_data(),
+                         courier.control.get_recipients_data(self.control_paths))
+        self.assertEqual(self.context.get_control_data(),
+                         courier.control.get_control_data(self.control_paths))
+
+    def testCopies(self):
+        rcpts = self.context.get_recipients_data()
+        rcpts[0][1] = 'modified'
+        rcpts.append(['extra', '', ''])
+        self.assertEqual(self.context.get_recipients_data(),
+                         courier.control.get_recipients_data(self.control_paths))
+
+    def testInvalidation(self):
+        rcpts = self.context.get_recipients()
+        courier.control.add_recipient(self.control_paths, 'new@example.com')
+        self.assertEqual(self.context.get_recipients(), rcpts + ['new@example.com'])
+        courier.control.del_recipient(self.control_paths, 'new@example.com')
+        self.assertEqual(self.context.get_recipients(), rcpts)
+
+    def testMessage(self):
+        msg = self.context.get_message()
+        self.assertIs(self.context.get_message(), msg)
+        copy = self.context.copy_message()
+        self.assertIsNot(copy, msg)
+        copy['X-Test'] = 'copy'
+        self.assertNotIn('X-Test', self.context.get_message())
+
+    def testXFilterSubmit(self):
+        msg = self.context.get_message()
+        mfilter = courier.xfilter.XFilter('testcontext', self.body_path,
+                                          self.control_paths, self.context)
+        mfilter.get_message()['X-Test'] = 'xfilter'
+        self.assertNotIn('X-Test', msg)
+        self.assertEqual(mfilter.submit(), '')
+        self.assertIsNot(self.context.get_message(), msg)
+        self.assertEqual(self.context.get_message()['X-Test'], 'xfilter')
+
+    def testBodyInvalidation(self):
+        self.context.get_message()
+        with open(self.body_path, 'ab') as body_file:
+            body_file.write(b'appended\n')
+        self.assertTrue(self.context.get_message().get_payload().endswith('appended\n'))
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCourierContext)
+    unittest.TextTestRunner(verbosity=2).run(suite)
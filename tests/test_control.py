@@ -295,6 +295,140 @@ class TestCourierControl(unittest.TestCase):
             self.assertEqual(courier.control.get_recipients_data(x['control_paths']),
                              x['control_data']['r'])
 
+    def testControlSet(self):
+        for x in message.values():
+            control_set = courier.control.ControlSet(x['control_paths'])
+            self.assertEqual(courier.control.get_control_data(control_set),
+                             x['control_data'])
+            self.assertEqual(courier.control.get_senders_ip(control_set),
+                             x['senders_ip'])
+            self.assertEqual(control_set.get_lines('s', 1), [x['control_data']['s']])
+            # Values returned to callers are copies.
+            control_set.get_recipients_data().append(rcpt_a)
+            control_set.get_recipients_data()[0][0] = ''
+            self.assertEqual(control_set.get_recipients_data(), x['control_data']['r'])
+            # A ControlSet isn't updated when the files change.
+            courier.control.add_recipient_data(control_set, rcpt_b)
+            self.assertEqual(control_set.get_recipients_data(), x['control_data']['r'])
+            courier.control.del_recipient_data(control_set, rcpt_b)
+            self.assertEqual(courier.control.get_recipients_data(x['control_paths']),
+                             x['control_data']['r'])
+
+    def testCache(self):
+        x = message['duplicate']
+        control_path = x['control_paths'][0]
+        control_file = courier.control._get_control_file(control_path)
+        self.assertTrue(courier.control._get_control_file(control_path) is control_file)
+        # Writes through the module discard the cached file.
+        courier.control.add_recipient_data(x['control_paths'], rcpt_b)
+        self.assertTrue(control_path not in courier.control._cache)
+        self.assertEqual(courier.control.get_recipients_data(x['control_paths']),
+                         x['control_data']['r'] + [rcpt_b])
+        # So do writes by other means.
+        with open(control_path, 'a') as control_file:
+            control_file.write('r%s\nR\nN\n' % rcpt_a[0])
+        self.assertEqual(courier.control.get_recipients_data(x['control_paths']),
+                         x['control_data']['r'] + [rcpt_b, rcpt_a])
+        cache_size = courier.control.cache_size
+        cache_bytes = courier.control.cache_bytes
+        last_paths = [message['ldapalias']['control_paths'][0],
+                      message['iso-8859-2']['control_paths'][0]]
+        courier.control.cache_size = 2
+        try:
+            for y in message.values():
+                courier.control.get_sender(y['control_paths'])
+            self.assertEqual(list(courier.control._cache), last_paths)
+            # The cache is also limited by the size of the files.
+            courier.control.cache_size = cache_size
+            courier.control.cache_bytes = sum([os.path.getsize(y) for y in last_paths])
+            for y in message.values():
+                courier.control.get_sender(y['control_paths'])
+            self.assertEqual(list(courier.control._cache), last_paths)
+            self.assertEqual(courier.control._cache_total, courier.control.cache_bytes)
+            # Files larger than that aren't cached.
+            courier.control._invalidate(last_paths[0])
+            courier.control.cache_bytes = os.path.getsize(last_paths[0]) - 1
+            courier.control.get_sender([last_paths[0]])
+            self.assertTrue(last_paths[0] not in courier.control._cache)
+        finally:
+            courier.control.cache_size = cache_size
+            courier.control.cache_bytes = cache_bytes
+
+    def testEdit(self):
+        for x in message.values():
+            with courier.control.edit(x['control_paths']) as tx:
+                tx.add_recipient_data(rcpt_b)
+                tx.add_recipient(rcpt_a[0])
+                self.assertTrue(tx.del_recipient_data(x['control_data']['r'][0]))
+                self.assertFalse(tx.del_recipient('nobody@example.com'))
+                self.assertEqual(tx.get_recipients_data(),
+                                 x['control_data']['r'][1:] + [rcpt_b, rcpt_a])
+                # Nothing is written until the edit is committed.
+                self.assertEqual(courier.control.get_recipients_data(x['control_paths']),
+                                 x['control_data']['r'])
+            self.assertEqual(courier.control.get_recipients_data(x['control_paths']),
+                             x['control_data']['r'][1:] + [rcpt_b, rcpt_a])
+            # A recipient added in an earlier edit may be removed.
+            with courier.control.edit(x['control_paths'], sync=True) as tx:
+                tx.del_recipient_data(rcpt_a)
+            self.assertEqual(courier.control.get_recipients_data(x['control_paths']),
+                             x['control_data']['r'][1:] + [rcpt_b])
+            # Changes are discarded if the block raises an exception.
+            try:
+                with courier.control.edit(x['control_paths']) as tx:
+                    tx.del_recipient_data(rcpt_b)
+                    raise RuntimeError()
+            except RuntimeError:
+                pass
+            self.assertEqual(courier.control.get_recipients_data(x['control_paths']),
+                             x['control_data']['r'][1:] + [rcpt_b])
+
+    def testEditDuplicates(self):
+        x = message['duplicate']
+        (first, second) = x['control_data']['r']
+        with courier.control.edit(x['control_paths']) as tx:
+            tx.add_recipient_data(rcpt_b)
+            # The second recipient is removed by its data, so the first
+            # recipient with its address is the first recipient.
+            self.assertTrue(tx.del_recipient_data(second))
+            self.assertFalse(tx.del_recipient_data(second))
+            self.assertTrue(tx.del_recipient(first[0]))
+            self.assertFalse(tx.del_recipient(first[0]))
+            self.assertEqual(tx.get_recipients_data(), [rcpt_b])
+            self.assertTrue(tx.del_recipient(rcpt_b[0]))
+            self.assertEqual(tx.get_recipients_data(), [])
+        self.assertEqual(courier.control.get_recipients_data(x['control_paths']), [])
+        # The deliveries are marked complete in the order of removal.
+        self.assertEqual([int(y.split()[0])
+                          for y in courier.control.get_lines(x['control_paths'], 'S')],
+                         [1, 0, 2])
+
+    def testIterRecipients(self):
+        for x in message.values():
+            recipients = list(courier.control.iter_recipients(x['control_paths']))
+            self.assertEqual([list(r) for r in recipients], x['control_data']['r'])
+            self.assertEqual([r.address for r in recipients],
+                             [r[0] for r in x['control_data']['r']])
+            # Delivered recipients are skipped.
+            courier.control.del_recipient_data(x['control_paths'], recipients[0])
+            self.assertEqual(list(courier.control.iter_recipients(x['control_paths'])),
+                             recipients[1:])
+
+    def testAddToLastFile(self):
+        for x in message.values():
+            control_paths = list(x['control_paths'])
+            with courier.control.edit(control_paths) as tx:
+                for y in range(200):
+                    tx.add_recipient_data(['rcpt%d@example.com' % y, '', ''])
+            # Every recipient is added to the last file, however many it
+            # has, and no other file is created.
+            self.assertEqual(control_paths, x['control_paths'])
+            self.assertFalse(os.path.exists('%s.%d' % (control_paths[0], len(control_paths))))
+            added = courier.control.get_recipients_data([control_paths[-1]])[-200:]
+            self.assertEqual([y[0] for y in added],
+                             ['rcpt%d@example.com' % y for y in range(200)])
+            self.assertEqual(courier.control.get_recipients_data(control_paths)[-200:], added)
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestCourierControl)
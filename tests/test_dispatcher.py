@@ -0,0 +1,1105 @@
+#!/usr/bin/python3
+# pythonfilter -- A python framework for Courier global filters
+# Copyright (C) 2007-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import asyncio
+import collections
+import concurrent.futures
+import importlib.machinery
+import importlib.util
+import io
+import json
+import os
+import pstats
+import select
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The dispatcher is a script, so it is loaded from its path.
+loader = importlib.machinery.SourceFileLoader('pythonfilter_dispatcher',
+                                              f'{project_root}/pythonfilter')
+spec = importlib.util.spec_from_loader(loader.name, loader)
+dispatcher = importlib.util.module_from_spec(spec)
+loader.exec_module(dispatcher)
+
+request = (f'{project_root}/tests/queuefiles/data-test1\n'
+           f'{project_root}/tests/queuefiles/control-duplicate\n\n').encode()
+
+
+def make_filter(name, function=None, parallel=False, options=None, bypass=None):
+    """Return a dispatcher Filter for function, which by default does nothing."""
+    module = types.SimpleNamespace(parallel_safe=parallel)
+    return dispatcher.Filter(name, function or (lambda body_path, control_paths: ''),
+                             bypass, module, options or {})
+
+
+def make_context(body_path=f'{project_root}/tests/queuefiles/data-test1'):
+    context = dispatcher.courier.context.MessageContext(
+        body_path, [f'{project_root}/tests/queuefiles/control-duplicate'])
+    context.trace = None
+    context.profiled = False
+    context.filter_replies = {}
+    return context
+
+
+# A filter that replies with the generation which init_filter recorded.
+reload_filter = '''
+generation = None
+
+
+def init_filter():
+    global generation
+    generation = %d
+
+
+def do_filter(body_path, control_paths):
+    return '550 Generation %%d' %% generation
+'''
+
+
+def send_request(path):
+    """Send a message to the filter socket at path, and return the reply."""
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    connection.connect(path)
+    connection.sendall(request)
+    reply = connection.recv(1024).decode()
+    connection.close()
+    return reply
+
+
+def spin(seconds):
+    """Use CPU time for seconds."""
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        pass
+
+
+class QuietStderr:
+    """Discard what the dispatcher logs while a test runs."""
+    def __enter__(self):
+        self.stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        sys.stderr.close()
+        sys.stderr = self.stderr
+        return False
+
+
+class TestDispatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.parallel_threads = dispatcher.parallel_threads
+        dispatcher.parallel_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=dispatcher.parallel_threads)
+        dispatcher.abandoned_filters = dispatcher.LockedCounter()
+
+    def tearDown(self):
+        dispatcher.parallel_executor.shutdown(wait=False)
+        dispatcher.parallel_threads = self.parallel_threads
+
+    def testAdmission(self):
+        active_filters = dispatcher.LockedCounter()
+        admission = dispatcher.Admission(active_filters, 2, 1)
+        with QuietStderr():
+            self.assertTrue(admission.admit())
+            active_filters.inc()
+            active_filters.inc()
+            # Messages are refused at the high watermark, until the
+            # number in progress falls to the low watermark.
+            self.assertFalse(admission.admit())
+            active_filters.dec()
+            self.assertTrue(admission.admit())
+        self.assertEqual(admission.refused.count, 1)
+        # A high watermark of 0 disables admission control.
+        self.assertTrue(dispatcher.Admission(active_filters, 0, 0).admit())
+
+    def testDisconnectedClient(self):
+        active_filters = dispatcher.LockedCounter()
+        admission = dispatcher.Admission(active_filters, 2, 1)
+        with QuietStderr():
+            for x in range(3):
+                self.assertTrue(admission.admit())
+                (server, client) = socket.socketpair(socket.AF_UNIX)
+                client.sendall(request)
+                # courierfilter gave up before the reply was sent.
+                client.close()
+                active_filters.inc()
+                dispatcher.process_message(server, [], active_filters)
+                self.assertEqual(active_filters.count, 0)
+                self.assertEqual(server.fileno(), -1)
+
+    def testRefuseMessage(self):
+        (server, client) = socket.socketpair(socket.AF_UNIX)
+        errors = []
+
+        def send_request():
+            try:
+                client.sendall(request)
+            except OSError as e:
+                errors.append(e)
+        # The request is sent after the connection is refused.
+        timer = threading.Timer(0.2, send_request)
+        timer.start()
+        dispatcher.refuse_message(server)
+        timer.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(client.recv(1024).decode(), dispatcher.overload_reply)
+        client.close()
+
+    def testLogging(self):
+        def fail(body_path, control_paths):
+            raise ValueError('broken filter')
+        self.addCleanup(setattr, sys, 'stderr', sys.stderr)
+        self.addCleanup(setattr, dispatcher.courier.log, '_json_lines', False)
+        self.addCleanup(setattr, dispatcher.courier.log, '_queue', None)
+        sys.stderr = io.StringIO()
+        # The dispatcher's lines are written by courier.log, which
+        # formats them as JSON in this mode.
+        dispatcher.courier.log.start(size=10, json_lines=True)
+        self.assertEqual(dispatcher.call_filter(make_filter('failing', fail), make_context()),
+                         '')
+        self.assertTrue(dispatcher.courier.log.flush())
+        records = [json.loads(x) for x in sys.stderr.getvalue().splitlines()]
+        self.assertEqual(records[0]['message'],
+                         'Uncaught exception in "failing" do_filter function: '
+                         "<class 'ValueError'>:broken filter")
+        self.assertIn('in fail', records[1]['message'])
+
+    def testTimeoutPolicy(self):
+        with QuietStderr():
+            # A filter which may modify the message isn't left running
+            # in the background.
+            self.assertEqual(make_filter('a', options={'timeout': 1.0}).wait_timeout, 0)
+            self.assertEqual(make_filter('a', parallel=True,
+                                         options={'timeout': 1.0}).wait_timeout, 1.0)
+            # Isolated filters enforce their timeout in the worker.
+            isolated = make_filter('a', options={'timeout': 1.0, 'isolate': True})
+            self.assertEqual((isolated.timeout, isolated.wait_timeout), (1.0, 0))
+
+    def testIsolatedParallel(self):
+        # The module's parallel_safe value wasn't set by its init_filter
+        # in the dispatcher, so an isolated filter must be listed with
+        # the "parallel" option.
+        self.assertFalse(make_filter('a', parallel=True, options={'isolate': True}).parallel)
+        self.assertTrue(make_filter('a', options={'isolate': True, 'parallel': True}).parallel)
+
+    def testAbandonedFilters(self):
+        dispatcher.parallel_threads = 1
+        dispatcher.parallel_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        release = threading.Event()
+
+        def hang(body_path, control_paths):
+            release.wait(10)
+            return ''
+        hung = make_filter('hung', hang, parallel=True, options={'timeout': 0.1})
+        waiting = make_filter('waiting', parallel=True)
+        plan = dispatcher.build_plan([hung, waiting])
+        with QuietStderr():
+            # The filter without a timeout can't get a thread, so it
+            # isn't waited for indefinitely.
+            (i_filter, reply_code) = dispatcher.run_filters(plan, make_context(), [0, [], 0])
+            self.assertEqual((i_filter, reply_code), (waiting, dispatcher.timeout_reply))
+            self.assertEqual(dispatcher.abandoned_filters.count, 1)
+            # Later messages are deferred without waiting.
+            start_time = time.time()
+            self.assertEqual(dispatcher.run_filters(plan, make_context(), [0, [], 0]),
+                             (None, dispatcher.timeout_reply))
+            self.assertLess(time.time() - start_time, 0.5)
+            release.set()
+            self.assertTrue(dispatcher.abandoned_filters.wait_for_zero(5))
+            self.assertEqual(dispatcher.run_filters(plan, make_context(), [0, [], 0]),
+                             (waiting, ''))
+
+    def testVerdictCache(self):
+        cache = dispatcher.VerdictCache(2, 60)
+        self.assertEqual(cache.get('a'), set())
+        cache.add('a', ['spfcheck'])
+        cache.add('a', ['dialback'])
+        self.assertEqual(cache.get('a'), set(['spfcheck', 'dialback']))
+        # The least recently used entry is discarded.
+        cache.add('b', ['spfcheck'])
+        cache.get('a')
+        cache.add('c', ['spfcheck'])
+        self.assertEqual(cache.get('b'), set())
+        self.assertEqual(cache.get('a'), set(['spfcheck', 'dialback']))
+        cache.discard('a')
+        self.assertEqual(cache.get('a'), set())
+        # Verdicts expire.
+        cache = dispatcher.VerdictCache(2, -1)
+        cache.add('a', ['spfcheck'])
+        self.assertEqual(cache.get('a'), set())
+
+    def testMessageDigest(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        with open(f'{project_root}/tests/queuefiles/data-test1', 'rb') as body_file:
+            body = body_file.read()
+        # Each delivery attempt has a new Received header.
+        retried = body.replace(b'Thu, 26 Jul 2007 21:30:01', b'Fri, 27 Jul 2007 01:00:00', 1)
+        changed = body.replace(b'\ntest', b'\nchanged')
+        for (name, data) in (('retried', retried), ('changed', changed)):
+            with open(f'{tmpdir}/{name}', 'wb') as body_file:
+                body_file.write(data)
+        digest = dispatcher.message_digest(make_context())
+        self.assertEqual(dispatcher.message_digest(make_context(f'{tmpdir}/retried')), digest)
+        self.assertNotEqual(dispatcher.message_digest(make_context(f'{tmpdir}/changed')), digest)
+
+    def testCacheVerdicts(self):
+        self.addCleanup(setattr, dispatcher, 'verdict_cache', dispatcher.verdict_cache)
+        dispatcher.verdict_cache = dispatcher.VerdictCache(10, 60)
+        parallel = make_filter('parallel', parallel=True)
+        failed = make_filter('failed', parallel=True)
+        serial = make_filter('serial')
+        context = make_context()
+        context.filter_replies = {parallel: '', failed: None, serial: ''}
+        (key, skip) = dispatcher.cached_verdicts(context)
+        self.assertEqual(skip, set())
+        # Parallel filters that passed a deferred message are skipped
+        # when it is retried.
+        dispatcher.cache_verdicts(key, '451 try again', context)
+        self.assertEqual(dispatcher.cached_verdicts(make_context()), (key, set(['parallel'])))
+        self.assertEqual(dispatcher.skip_filters([parallel, failed, serial], set(), set(['parallel'])),
+                         [failed, serial])
+        # A message that won't be retried is forgotten.
+        dispatcher.cache_verdicts(key, '200 Ok', context)
+        self.assertEqual(dispatcher.cached_verdicts(make_context()), (key, set()))
+        # If the message can't be read, every filter runs.
+        with QuietStderr():
+            self.assertEqual(dispatcher.cached_verdicts(make_context('/nonexistent')),
+                             (None, set()))
+        dispatcher.cache_verdicts(None, '451 try again', context)
+        self.assertNotIn(None, dispatcher.verdict_cache.entries)
+
+    def testLanePending(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(f'{tmpdir}/socket')
+        listener.listen(8)
+        self.addCleanup(listener.close)
+        for (name, function) in (('stop_files', lambda: []),
+                                 ('message_lane', lambda context: 'other')):
+            self.addCleanup(setattr, dispatcher, name, getattr(dispatcher, name))
+            setattr(dispatcher, name, function)
+        # Fill the general pool's worker and its queue.
+        release = threading.Event()
+        pool = dispatcher.WorkerPool(1, 1)
+        pool.submit(release.wait, (10,))
+        pool.submit(release.wait, (10,))
+        while pool.busy.count < 1:
+            time.sleep(0.01)
+        lanes = {'authenticated': dispatcher.WorkerPool(1, 1)}
+        pending = collections.deque()
+        reading = []
+        active_filters = dispatcher.LockedCounter()
+        admission = dispatcher.Admission(active_filters, 0, 0)
+        chain = dispatcher.FilterChain([dispatcher.ChainRule('default', None, [])])
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(f'{tmpdir}/socket')
+        client.sendall(request)
+        with QuietStderr():
+            # Without admission control, the message isn't refused
+            # when the general pool is full.  It waits for room, once
+            # its request has been read.
+            self.assertTrue(dispatcher.wait_for_message(listener, chain, active_filters, pool,
+                                                        admission, lanes, pending, reading))
+            self.assertEqual(len(reading), 1)
+            self.assertTrue(dispatcher.wait_for_message(listener, chain, active_filters, pool,
+                                                        admission, lanes, pending, reading))
+            self.assertEqual(len(reading), 0)
+            self.assertEqual(len(pending), 1)
+            release.set()
+            while pool.queue.full():
+                time.sleep(0.01)
+            # The pending message is submitted before the next one is
+            # accepted.
+            second = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            second.connect(f'{tmpdir}/socket')
+            second.sendall(request)
+            dispatcher.wait_for_message(listener, chain, active_filters, pool,
+                                        admission, lanes, pending, reading)
+            self.assertEqual(len(pending), 0)
+            while reading:
+                dispatcher.wait_for_message(listener, chain, active_filters, pool,
+                                            admission, lanes, pending, reading)
+            self.assertEqual(client.recv(1024).decode(), '200 Ok')
+            self.assertEqual(second.recv(1024).decode(), '200 Ok')
+        client.close()
+        second.close()
+
+    def testRequestReader(self):
+        (server, client) = socket.socketpair(socket.AF_UNIX)
+        self.addCleanup(client.close)
+        self.addCleanup(server.close)
+        reader = dispatcher.RequestReader(server, None)
+        # The request is read as it arrives, without waiting for the
+        # rest of it.
+        client.sendall(request[:10])
+        self.assertIsNone(reader.read())
+        client.sendall(request[10:])
+        context = reader.read()
+        self.assertEqual(context.body_path, f'{project_root}/tests/queuefiles/data-test1')
+        self.assertEqual(context.control_paths,
+                         [f'{project_root}/tests/queuefiles/control-duplicate'])
+        # The request may also end when courierfilter closes its end.
+        (server, client) = socket.socketpair(socket.AF_UNIX)
+        self.addCleanup(server.close)
+        reader = dispatcher.RequestReader(server, None)
+        client.sendall(b'data-test1\ncontrol-duplicate')
+        client.close()
+        self.assertIsNone(reader.read())
+        context = reader.read()
+        self.assertEqual(context.body_path,
+                         dispatcher.courier.config.localstatedir + '/tmp/data-test1')
+        self.assertEqual(len(context.control_paths), 1)
+        # A connection that closes without a request is an error.
+        (server, client) = socket.socketpair(socket.AF_UNIX)
+        self.addCleanup(server.close)
+        reader = dispatcher.RequestReader(server, None)
+        client.close()
+        self.assertRaises(OSError, reader.read)
+
+    def testSlowRequest(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(f'{tmpdir}/socket')
+        listener.listen(8)
+        self.addCleanup(listener.close)
+        for (name, value) in (('stop_files', lambda: []),
+                              ('message_lane', lambda context: 'authenticated'),
+                              ('request_timeout', 0.5)):
+            self.addCleanup(setattr, dispatcher, name, getattr(dispatcher, name))
+            setattr(dispatcher, name, value)
+        pool = dispatcher.WorkerPool(1, 1)
+        lanes = {'authenticated': dispatcher.WorkerPool(1, 1)}
+        pending = collections.deque()
+        reading = []
+        active_filters = dispatcher.LockedCounter()
+        admission = dispatcher.Admission(active_filters, 0, 0)
+        chain = dispatcher.FilterChain([dispatcher.ChainRule('default', None, [])])
+        # A client that never sends its request doesn't delay the
+        # message that follows it.
+        slow = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        slow.connect(f'{tmpdir}/socket')
+        self.addCleanup(slow.close)
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(f'{tmpdir}/socket')
+        self.addCleanup(client.close)
+        client.sendall(request)
+        lane_messages = dispatcher.lane_messages.get('authenticated') or 0
+        start = time.time()
+        with QuietStderr():
+            while len(reading) < 2:
+                dispatcher.wait_for_message(listener, chain, active_filters, pool,
+                                            admission, lanes, pending, reading)
+            while len(reading) > 1:
+                dispatcher.wait_for_message(listener, chain, active_filters, pool,
+                                            admission, lanes, pending, reading)
+            self.assertEqual(client.recv(1024).decode(), '200 Ok')
+            self.assertLess(time.time() - start, dispatcher.request_timeout)
+            self.assertEqual(dispatcher.lane_messages.get('authenticated'), lane_messages + 1)
+            # The slow client's connection is closed once its time is
+            # up, and it isn't counted as a message in progress.
+            self.assertEqual(active_filters.count, 1)
+            while reading:
+                dispatcher.wait_for_message(listener, chain, active_filters, pool,
+                                            admission, lanes, pending, reading)
+            self.assertEqual(slow.recv(1024), b'')
+            self.assertEqual(active_filters.count, 0)
+
+    def testRefuseUnread(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(f'{tmpdir}/socket')
+        listener.listen(8)
+        self.addCleanup(listener.close)
+        self.addCleanup(setattr, dispatcher, 'stop_files', dispatcher.stop_files)
+        dispatcher.stop_files = lambda: []
+        active_filters = dispatcher.LockedCounter()
+        active_filters.inc()
+        admission = dispatcher.Admission(active_filters, 1, 1)
+        chain = dispatcher.FilterChain([dispatcher.ChainRule('default', None, [])])
+        reading = []
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(f'{tmpdir}/socket')
+        self.addCleanup(client.close)
+        with QuietStderr():
+            # A refused message's request is read before the reply is
+            # sent, without waiting for it in the accepting thread.
+            dispatcher.wait_for_message(listener, chain, active_filters, None,
+                                        admission, {}, None, reading)
+            self.assertEqual(len(reading), 1)
+            client.sendall(request)
+            while reading:
+                dispatcher.wait_for_message(listener, chain, active_filters, None,
+                                            admission, {}, None, reading)
+        self.assertEqual(client.recv(1024).decode(), dispatcher.overload_reply)
+        self.assertEqual(active_filters.count, 1)
+
+    def testMessageLane(self):
+        self.addCleanup(setattr, dispatcher.courier.config, 'is_relayed',
+                        dispatcher.courier.config.is_relayed)
+        dispatcher.courier.config.is_relayed = lambda ip: ip == '192.0.2.1'
+
+        def context(auth_user=None, senders_ip=None):
+            return types.SimpleNamespace(get_auth_user=lambda: auth_user,
+                                         get_senders_ip=lambda: senders_ip)
+        self.assertEqual(dispatcher.message_lane(context('user', '192.0.2.1')),
+                         'authenticated')
+        self.assertEqual(dispatcher.message_lane(context(None, '192.0.2.1')), 'relayed')
+        self.assertEqual(dispatcher.message_lane(context(None, '192.0.2.2')), 'other')
+        self.assertEqual(dispatcher.message_lane(context()), 'other')
+
+        # A control file that can't be read is classified as other.
+        def fail():
+            raise OSError('unreadable')
+        self.assertEqual(dispatcher.message_lane(
+            types.SimpleNamespace(get_auth_user=fail)), 'other')
+        self.assertEqual(dispatcher.message_lane(make_context()), 'other')
+
+    def testCreateLanes(self):
+        self.addCleanup(setattr, dispatcher, 'priority_lanes', dispatcher.priority_lanes)
+        dispatcher.priority_lanes = {'authenticated': 2, 'relayed': 0, 'unknown': 1}
+        with QuietStderr():
+            lanes = dispatcher.create_lanes(dispatcher.FilterExecutor)
+        self.addCleanup(lanes['authenticated'].shutdown, wait=False)
+        # Unknown classes, and lanes without threads, are skipped.
+        self.assertEqual(list(lanes), ['authenticated'])
+        self.assertEqual(lanes['authenticated'].threads, 2)
+        dispatcher.priority_lanes = {}
+        self.assertEqual(dispatcher.create_lanes(dispatcher.FilterExecutor), {})
+
+    def testFormatScore(self):
+        self.addCleanup(setattr, dispatcher, 'reorder_min_calls',
+                        dispatcher.reorder_min_calls)
+        dispatcher.reorder_min_calls = 2
+        scored = make_filter('format_scored', options={'reorder': None})
+        unscored = make_filter('format_unscored', options={'reorder': None})
+        listed = make_filter('format_listed')
+        for x in range(2):
+            dispatcher.filter_seconds.observe(0.5, 'format_scored')
+        dispatcher.filter_verdicts.inc('format_scored', '5xx')
+        self.assertEqual(dispatcher.format_score(scored), 'format_scored(1.000000)')
+        self.assertEqual(dispatcher.format_score(unscored), 'format_unscored(-)')
+        self.assertEqual(dispatcher.format_score(listed), 'format_listed')
+
+    def testParseOptions(self):
+        with QuietStderr():
+            options = dispatcher.parse_options('test', ['parallel', 'reorder', 'isolate',
+                                                        'timeout=2.5', 'on_timeout=tempfail'])
+            invalid = dispatcher.parse_options('test', ['bogus', 'timeout=soon',
+                                                        'on_timeout=never'])
+        self.assertEqual(options, {'parallel': True, 'reorder': True, 'isolate': True,
+                                   'timeout': 2.5, 'on_timeout': 'tempfail'})
+        self.assertEqual(invalid, {})
+
+    def testBuildPlan(self):
+        (a, b, c, d, e) = [make_filter(x, parallel=x in 'abde') for x in 'abcde']
+        self.assertEqual(dispatcher.build_plan([a, b, c, d, e]), [[a, b], [c], [d, e]])
+        self.assertEqual(dispatcher.build_plan([c, a, c]), [[c], [a], [c]])
+        self.assertEqual(dispatcher.build_plan([]), [])
+
+    def testStepDecided(self):
+        (a, b, c) = [make_filter(x) for x in 'abc']
+        whitelist = make_filter('whitelist', bypass=['b'])
+        # The first filter listed that makes a decision wins, whichever
+        # finished first.
+        acct = [0, [], 0]
+        results = [(a, '', 1), (b, '550 Rejected by b', 2), (c, '451 Deferred by c', 3)]
+        self.assertEqual(dispatcher.step_decided(results, acct, set()),
+                         (b, '550 Rejected by b', True))
+        self.assertEqual(acct, [0, [['a', 1], ['b', 2], ['c', 3]], 6])
+        # A filter bypassed by an earlier filter in the step is ignored.
+        bypass = set()
+        results = [(whitelist, '200 Ok', 0), (b, '550 Rejected by b', 0), (c, '', 0)]
+        self.assertEqual(dispatcher.step_decided(results, [0, [], 0], bypass),
+                         (c, '', False))
+        self.assertEqual(bypass, {'b'})
+        # A filter listed after the one that decided doesn't bypass it.
+        results = [(b, '550 Rejected by b', 0), (whitelist, '200 Ok', 0)]
+        self.assertEqual(dispatcher.step_decided(results, [0, [], 0], set()),
+                         (b, '550 Rejected by b', True))
+
+    def testWorkerPool(self):
+        release = threading.Event()
+        finished = []
+        pool = dispatcher.WorkerPool(2, 1)
+
+        def job(name):
+            release.wait(10)
+            finished.append(name)
+
+        def fail():
+            raise ValueError('job failed')
+        with QuietStderr():
+            pool.submit(fail, ())
+            for x in range(3):
+                pool.submit(job, (x,))
+            while pool.busy.count < 2:
+                time.sleep(0.01)
+            self.assertTrue(pool.full())
+            self.assertEqual(pool.stats(), {'workers': 2, 'busy': 2, 'queued': 1,
+                                            'queue_size': 1, 'utilization': 1.0})
+            release.set()
+            while len(finished) < 3:
+                time.sleep(0.01)
+            self.assertFalse(pool.full())
+        # The worker which ran the failing job is still running jobs.
+        self.assertEqual(sorted(finished), [0, 1, 2])
+        while pool.busy.count:
+            time.sleep(0.01)
+        self.assertEqual(pool.stats()['busy'], 0)
+
+    def testReorderGroup(self):
+        self.addCleanup(setattr, dispatcher, 'reorder_min_calls',
+                        dispatcher.reorder_min_calls)
+        dispatcher.reorder_min_calls = 1
+
+        def scored(name, seconds, rejections, bypass=None):
+            dispatcher.filter_seconds.observe(seconds, name)
+            if rejections:
+                dispatcher.filter_verdicts.inc(name, '5xx', amount=rejections)
+            return make_filter(name, options={'reorder': True}, bypass=bypass)
+        slow = scored('reorder_slow', 4, 1)
+        fast = scored('reorder_fast', 1, 1)
+        useless = scored('reorder_useless', 0.1, 0)
+        # The filter which spends least time per rejection runs first,
+        # and filters which never reject run last.
+        self.assertEqual(dispatcher.reorder_group([slow, useless, fast]),
+                         [fast, slow, useless])
+        # A whitelist stays ahead of the filters it bypasses.
+        whitelist = scored('reorder_whitelist', 10, 1, bypass=['reorder_fast'])
+        self.assertEqual(dispatcher.reorder_group([whitelist, slow, fast]),
+                         [slow, whitelist, fast])
+        # Nothing moves until every filter has a score.
+        unscored = make_filter('reorder_unscored', options={'reorder': True})
+        self.assertEqual(dispatcher.reorder_group([slow, unscored, fast]),
+                         [slow, unscored, fast])
+
+    def testHandoff(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        filter_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        filter_socket.bind(f'{tmpdir}/pythonfilter')
+        filter_socket.listen(4)
+        self.addCleanup(setattr, dispatcher, 'handoff_server', None)
+        self.assertEqual(dispatcher.receive_socket(f'{tmpdir}/handoff'), None)
+        dispatcher.handoff_server = dispatcher.HandoffServer(f'{tmpdir}/handoff', filter_socket)
+        self.assertEqual(dispatcher.stop_files(),
+                         [sys.stdin, dispatcher.handoff_server.stop_fd])
+        received = dispatcher.receive_socket(f'{tmpdir}/handoff')
+        self.assertEqual(received.getsockname(), filter_socket.getsockname())
+        # The old process sees that it should stop accepting messages.
+        ready = select.select([dispatcher.handoff_server.stop_fd], [], [], 5)[0]
+        self.assertEqual(ready, [dispatcher.handoff_server.stop_fd])
+        # It waits for its messages before closing its copy of the
+        # socket, and leaves the path to the new process.
+        paths = []
+        with QuietStderr():
+            dispatcher.drain(f'{tmpdir}/pythonfilter', filter_socket,
+                             lambda: paths.append(os.path.exists(f'{tmpdir}/pythonfilter')))
+        self.assertEqual(paths, [True])
+        self.assertTrue(os.path.exists(f'{tmpdir}/pythonfilter'))
+        # The new process still accepts connections.
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        client.connect(f'{tmpdir}/pythonfilter')
+        (connection, address) = received.accept()
+        connection.close()
+        client.close()
+        # Without handoff, the path is removed before waiting, so that
+        # courier stops sending messages.
+        dispatcher.handoff_server = None
+        paths = []
+        dispatcher.drain(f'{tmpdir}/pythonfilter', received,
+                         lambda: paths.append(os.path.exists(f'{tmpdir}/pythonfilter')))
+        self.assertEqual(paths, [False])
+
+    def testProfiler(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        profiler = dispatcher.Profiler(tmpdir, 2, 0)
+        self.assertFalse(profiler.sample())
+        with QuietStderr():
+            profiler.toggle()
+        self.assertEqual([profiler.sample() for x in range(4)], [True, False, True, False])
+        for x in range(2):
+            profile = dispatcher.start_profile()
+            spin(0.05)
+            profile.disable()
+            profiler.add('spinner', profile)
+        # cProfile isn't used where it would record every thread.
+        version_info = sys.version_info
+        self.addCleanup(setattr, sys, 'version_info', version_info)
+        sys.version_info = (3, 12, 0)
+        profile = dispatcher.start_profile()
+        sys.version_info = version_info
+        self.assertIsInstance(profile, dispatcher.SampledProfile)
+        spin(0.05)
+        profile.disable()
+        profiler.add('spinner', profile)
+        with QuietStderr():
+            profiler.toggle()
+        self.assertFalse(profiler.active)
+        self.assertFalse(profiler.sample())
+        stats = pstats.Stats(f'{tmpdir}/spinner.{os.getpid()}.pstats')
+        self.assertIn('spin', [x[2] for x in stats.stats])
+        self.assertEqual((profiler.sampled, profiler.messages), (2, 4))
+
+    def testSampledProfile(self):
+        profile = dispatcher.SampledProfile(sys._getframe(), 0.001)
+        spin(0.1)
+        profile.disable()
+        stats = pstats.Stats(profile).stats
+        functions = dict([(x[2], stats[x]) for x in stats])
+        # Only the functions called after the profile started are sampled.
+        self.assertEqual(sorted(functions), ['spin'])
+        (calls, primitive_calls, own_time, cumulative_time, callers) = functions['spin']
+        self.assertGreater(calls, 0)
+        self.assertEqual(own_time, cumulative_time)
+        self.assertGreater(own_time, 0.05)
+        # A profile with no samples is left out.
+        profiler = dispatcher.Profiler(None, 1, 0)
+        profiler.active = True
+        profile = dispatcher.SampledProfile(sys._getframe(), 10)
+        profile.disable()
+        profiler.add('idle', profile)
+        self.assertEqual(profiler.stats, {})
+        # Another thread's work isn't included.
+        profile = dispatcher.SampledProfile(sys._getframe(), 0.001)
+        worker = threading.Thread(target=spin, args=(0.1,))
+        worker.start()
+        worker.join()
+        profile.disable()
+        functions = [x[2] for x in pstats.Stats(profile).stats]
+        self.assertIn('join', functions)
+        self.assertNotIn('spin', functions)
+
+    def testToggleProfiling(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        self.addCleanup(setattr, dispatcher, 'profiler', None)
+        with QuietStderr():
+            # Without profile_dir, the signal is only logged.
+            dispatcher.toggle_profiling()
+            dispatcher.profiler = dispatcher.Profiler(tmpdir, 1, 1)
+            dispatcher.toggle_profiling()
+            deadline = time.time() + 5
+            while not dispatcher.profiler.active and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertTrue(dispatcher.profiler.sample())
+            profile = dispatcher.start_profile()
+            spin(0.01)
+            profile.disable()
+            dispatcher.profiler.add('spinner', profile)
+            # Profiling stops after profile_duration seconds.
+            while dispatcher.profiler.active and time.time() < deadline:
+                time.sleep(0.05)
+        self.assertFalse(dispatcher.profiler.active)
+        self.assertTrue(os.path.exists(f'{tmpdir}/spinner.{os.getpid()}.pstats'))
+
+    def serve_asyncio(self, filters, client):
+        """Run the 'asyncio' dispatcher until client, in another thread, stops it.
+
+        client is called with the socket path, and a function that closes
+        stdin.
+
+        """
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = f'{tmpdir}/pythonfilter'
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        listener.listen(8)
+        (stop_read, stop_write) = os.pipe()
+        self.addCleanup(os.close, stop_read)
+        self.addCleanup(os.close, stop_write)
+        self.addCleanup(setattr, dispatcher, 'stop_files', dispatcher.stop_files)
+        dispatcher.stop_files = lambda: [stop_read]
+        chain = dispatcher.FilterChain([dispatcher.ChainRule('default', None, filters)])
+        errors = []
+
+        def run():
+            try:
+                client(path, lambda: os.write(stop_write, b'x'))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                os.write(stop_write, b'x')
+        thread = threading.Thread(target=run)
+        thread.start()
+        with QuietStderr():
+            asyncio.run(dispatcher.serve_asyncio(listener, path, chain))
+        thread.join()
+        self.assertEqual(errors, [])
+        self.assertFalse(os.path.exists(path))
+
+    def testAsyncioAccept(self):
+        async def reject(body_path, control_paths):
+            return '550 Rejected by async filter'
+
+        def client(path, stop):
+            self.assertEqual(send_request(path), '550 Rejected by async filter')
+        self.serve_asyncio([make_filter('allow'), make_filter('reject', reject)], client)
+
+    def testAsyncioTimeout(self):
+        self.addCleanup(setattr, dispatcher, 'worker_threads', dispatcher.worker_threads)
+        dispatcher.worker_threads = 1
+        release = threading.Event()
+
+        def hang(body_path, control_paths):
+            release.wait(10)
+            return '550 Rejected late'
+        hung = make_filter('hang', hang, parallel=True, options={'timeout': 0.2})
+
+        def client(path, stop):
+            # The filter's reply is ignored, and it keeps its thread.
+            self.assertEqual(send_request(path), '200 Ok')
+            self.assertEqual(dispatcher.abandoned_filters.count, 1)
+            # The only thread is held, so messages are deferred.
+            self.assertEqual(send_request(path), dispatcher.timeout_reply)
+            release.set()
+            deadline = time.time() + 5
+            while dispatcher.abandoned_filters.count and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(send_request(path), '550 Rejected late')
+        self.serve_asyncio([hung], client)
+
+    def testAsyncioShutdown(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def wait(body_path, control_paths):
+            started.set()
+            release.wait(10)
+            return '550 Rejected after shutdown'
+
+        def client(path, stop):
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.connect(path)
+            connection.sendall(request)
+            started.wait(5)
+            stop()
+            # The socket is removed, so courier stops sending messages,
+            # and the message in progress is finished.
+            deadline = time.time() + 5
+            while os.path.exists(path) and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertFalse(os.path.exists(path))
+            release.set()
+            self.assertEqual(connection.recv(1024).decode(), '550 Rejected after shutdown')
+            connection.close()
+        self.serve_asyncio([make_filter('wait', wait)], client)
+
+    def testAsyncioLane(self):
+        for (name, value) in (('worker_threads', 1),
+                              ('priority_lanes', {'authenticated': 1})):
+            self.addCleanup(setattr, dispatcher, name, getattr(dispatcher, name))
+            setattr(dispatcher, name, value)
+        lane = ['other']
+        self.addCleanup(setattr, dispatcher, 'message_lane', dispatcher.message_lane)
+        dispatcher.message_lane = lambda context: lane[0]
+        started = threading.Event()
+        release = threading.Event()
+
+        def hold(body_path, control_paths):
+            if lane[0] == 'other':
+                started.set()
+                release.wait(10)
+            return ''
+
+        def client(path, stop):
+            replies = []
+            held = threading.Thread(target=lambda: replies.append(send_request(path)))
+            held.start()
+            started.wait(5)
+            # The general executor's only thread is held, but the
+            # lane has a thread of its own.
+            lane[0] = 'authenticated'
+            self.assertEqual(send_request(path), '200 Ok')
+            release.set()
+            held.join()
+            self.assertEqual(replies, ['200 Ok'])
+        self.serve_asyncio([make_filter('hold', hold)], client)
+
+    def filter_package(self, config):
+        """Return a directory from which filters are imported.
+
+        The filter modules are written to its pythonfilter package, and
+        config is used as the contents of pythonfilter.conf.
+
+        """
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        os.mkdir(f'{tmpdir}/pythonfilter')
+        open(f'{tmpdir}/pythonfilter/__init__.py', 'w').close()
+        # The filters are imported from tmpdir, rather than the filters
+        # directory.
+        saved_modules = dict([x for x in sys.modules.items()
+                              if x[0] == 'pythonfilter' or x[0].startswith('pythonfilter.')])
+        for name in saved_modules:
+            del sys.modules[name]
+        sys.path.insert(0, tmpdir)
+
+        def restore():
+            sys.path.remove(tmpdir)
+            for name in [x for x in sys.modules
+                         if x == 'pythonfilter' or x.startswith('pythonfilter.')]:
+                del sys.modules[name]
+            sys.modules.update(saved_modules)
+        self.addCleanup(restore)
+        self.addCleanup(setattr, dispatcher, 'open_config', dispatcher.open_config)
+        dispatcher.open_config = lambda: io.StringIO(config)
+        return tmpdir
+
+    def testParseChain(self):
+        rule = dispatcher.parse_chain('chain outbound when authenticated or relayed'.split())
+        self.assertEqual(rule.name, 'outbound')
+        self.assertEqual(rule.filters, [])
+        self.assertTrue(callable(rule.predicate))
+        # A line without "when", or with an invalid predicate, stops
+        # pythonfilter.
+        with QuietStderr():
+            for line in ('chain outbound', 'chain outbound if authenticated',
+                         'chain outbound when', 'chain outbound when authenticated and',
+                         'chain outbound when size>lots'):
+                self.assertRaises(SystemExit, dispatcher.parse_chain, line.split())
+
+    def testLoadChainRules(self):
+        tmpdir = self.filter_package('# Filters for every message\n'
+                                     'chain_first\n'
+                                     'chain_second\n'
+                                     '\n'
+                                     'chain large when size>1M\n'
+                                     'chain_second\n'
+                                     'chain small when size<1M\n'
+                                     'chain_first parallel timeout=2\n'
+                                     'chain_second\n')
+        for name in ('chain_first', 'chain_second'):
+            with open(f'{tmpdir}/pythonfilter/{name}.py', 'w') as module_file:
+                module_file.write('calls = []\n\n\n'
+                                  'def init_filter():\n'
+                                  '    calls.append("init")\n\n\n'
+                                  'def do_filter(body_path, control_paths):\n'
+                                  '    return "550 %s"\n' % name)
+        with QuietStderr():
+            rules = dispatcher.load_chain_rules()
+        # The default rule is last, with the filters listed before the
+        # first chain.
+        self.assertEqual([x.name for x in rules], ['large', 'small', 'default'])
+        self.assertEqual([[y.name for y in x.filters] for x in rules],
+                         [['chain_second'], ['chain_first', 'chain_second'],
+                          ['chain_first', 'chain_second']])
+        self.assertIsNone(rules[-1].predicate)
+        self.assertEqual(rules[1].filters[0].timeout, 2)
+        # A module listed in several chains is imported and initialized
+        # once.
+        self.assertIs(rules[1].filters[0].function, rules[-1].filters[0].function)
+        self.assertEqual(sys.modules['pythonfilter.chain_first'].calls, ['init'])
+        chain = dispatcher.FilterChain(rules)
+        self.assertEqual(dispatcher.format_rules(rules),
+                         'large: chain_second; small: chain_first chain_second; '
+                         'default: chain_first chain_second')
+        self.assertEqual(len(chain.filters), 5)
+        # The small message is given to the first chain that matches it.
+        plan = dispatcher.select_plan(chain.plans, make_context())
+        self.assertEqual([[y.name for y in x] for x in plan],
+                         [['chain_first'], ['chain_second']])
+        self.assertIs(plan[0][0], rules[1].filters[0])
+
+    def testSelectPlan(self):
+        def fail(context):
+            raise OSError('unreadable')
+        plans = [('failing', fail, ['failing plan']),
+                 ('unmatched', lambda context: False, ['unmatched plan']),
+                 ('matched', lambda context: True, ['matched plan']),
+                 ('default', None, ['default plan'])]
+        with QuietStderr():
+            self.assertEqual(dispatcher.select_plan(plans, make_context()), ['matched plan'])
+        # A predicate that fails doesn't match.  Messages that match no
+        # predicate use the default plan.
+        with QuietStderr():
+            self.assertEqual(dispatcher.select_plan(plans[:2] + plans[3:], make_context()),
+                             ['default plan'])
+        self.assertEqual(dispatcher.select_plan(plans[1:2], make_context()), [])
+        # A real predicate selects by the details of the message.
+        rules = [dispatcher.parse_chain('chain large when size>1M'.split()),
+                 dispatcher.ChainRule('default', None, [make_filter('default_filter')])]
+        plans = dispatcher.FilterChain(rules).plans
+        self.assertEqual(dispatcher.select_plan(plans, make_context())[0][0].name,
+                         'default_filter')
+
+    def testReload(self):
+        tmpdir = self.filter_package('reload_test\n')
+
+        def write_filter(text):
+            with open(f'{tmpdir}/pythonfilter/reload_test.py', 'w') as module_file:
+                module_file.write(text)
+        write_filter(reload_filter % 1)
+        with QuietStderr():
+            chain = dispatcher.FilterChain(dispatcher.load_chain_rules())
+        old_filters = chain.filters
+        self.assertEqual(old_filters[0].function('', []), '550 Generation 1')
+        # The new module is initialized without changing the one used
+        # by messages in progress.
+        write_filter(reload_filter % 20)
+        with QuietStderr():
+            dispatcher.reload_filters(chain)
+        self.assertEqual(chain.filters[0].function('', []), '550 Generation 20')
+        self.assertEqual(old_filters[0].function('', []), '550 Generation 1')
+        # If a filter can't be loaded, the current filters are kept.
+        current_filters = chain.filters
+        write_filter('def do_filter(body_path, control_paths):\n    return (\n')
+        with QuietStderr():
+            dispatcher.reload_filters(chain)
+        self.assertIs(chain.filters, current_filters)
+        # A reload which starts while another is running does nothing.
+        write_filter(reload_filter % 300)
+        dispatcher.reload_lock.acquire()
+        try:
+            with QuietStderr():
+                dispatcher.reload_filters(chain)
+        finally:
+            dispatcher.reload_lock.release()
+        self.assertIs(chain.filters, current_filters)
+        with QuietStderr():
+            dispatcher.reload_filters(chain)
+        self.assertEqual(chain.filters[0].function('', []), '550 Generation 300')
+
+    def testStartServing(self):
+        calls = []
+        for name in ('serve', 'supervise_processes'):
+            self.addCleanup(setattr, dispatcher, name, getattr(dispatcher, name))
+            setattr(dispatcher, name, lambda *args, name=name: calls.append(name))
+        self.addCleanup(setattr, dispatcher, 'processes', dispatcher.processes)
+        ttldb = sys.modules.get('pythonfilter.ttldb')
+        self.addCleanup(sys.modules.__setitem__, 'pythonfilter.ttldb', ttldb)
+        if ttldb is None:
+            self.addCleanup(sys.modules.pop, 'pythonfilter.ttldb')
+        sys.modules['pythonfilter.ttldb'] = types.SimpleNamespace(open_dbm_files=lambda: [])
+        dispatcher.processes = 1
+        dispatcher.start_serving(None, None, None)
+        dispatcher.processes = 2
+        dispatcher.start_serving(None, None, None)
+        # dbm files can't be shared by several processes.
+        sys.modules['pythonfilter.ttldb'].open_dbm_files = lambda: ['/var/lib/pythonfilter/x']
+        with QuietStderr():
+            dispatcher.start_serving(None, None, None)
+        self.assertEqual(calls, ['serve', 'supervise_processes', 'serve'])
+
+    def testSuperviseProcesses(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(f'{tmpdir}/pythonfilter')
+        listener.listen(4)
+        (stop_read, stop_write) = os.pipe()
+        (report_read, report_write) = os.pipe()
+        for fd in (stop_read, stop_write, report_read, report_write):
+            self.addCleanup(os.close, fd)
+        for signum in (signal.SIGHUP, signal.SIGUSR2):
+            self.addCleanup(signal.signal, signum, signal.getsignal(signum))
+        for name in ('processes', 'stop_files', 'start_reload', 'serve'):
+            self.addCleanup(setattr, dispatcher, name, getattr(dispatcher, name))
+        dispatcher.processes = 2
+        dispatcher.stop_files = lambda: [stop_read]
+        reloads = []
+        dispatcher.start_reload = reloads.append
+
+        def serve(filter_socket, filter_socket_path, chain, index):
+            # This runs in the worker process.
+            signal.signal(signal.SIGHUP,
+                          lambda signum, frame: os.write(report_write, b'hup %d\n' % index))
+            os.write(report_write, b'start %d %d\n' % (index, os.getpid()))
+            select.select([stop_read], [], [])
+        dispatcher.serve = serve
+
+        reports = []
+
+        def read_report():
+            while b'\n' not in b''.join(reports):
+                if not select.select([report_read], [], [], 10)[0]:
+                    raise AssertionError('no report from the worker processes')
+                reports.append(os.read(report_read, 1024))
+            (line, newline, rest) = b''.join(reports).partition(b'\n')
+            reports[:] = [rest]
+            return line.decode().split()
+        results = {}
+
+        def control():
+            try:
+                started = dict([read_report()[1:] for x in range(2)])
+                results['started'] = started
+                os.kill(int(started['0']), signal.SIGKILL)
+                # The supervisor replaces a worker that exits.
+                results['restarted'] = read_report()
+                # Reloads are passed on to the worker processes.
+                os.kill(os.getpid(), signal.SIGHUP)
+                results['reloaded'] = sorted([read_report() for x in range(2)])
+            finally:
+                os.write(stop_write, b'x')
+        thread = threading.Thread(target=control)
+        thread.start()
+        chain = dispatcher.FilterChain([dispatcher.ChainRule('default', None, [])])
+        with QuietStderr():
+            dispatcher.supervise_processes(listener, f'{tmpdir}/pythonfilter', chain)
+        thread.join()
+        self.assertEqual(sorted(results['started']), ['0', '1'])
+        self.assertEqual(results['restarted'][:2], ['start', '0'])
+        self.assertNotEqual(results['restarted'][2], results['started']['0'])
+        self.assertEqual(results['reloaded'], [['hup', '0'], ['hup', '1']])
+        self.assertEqual(reloads, [chain])
+        self.assertFalse(os.path.exists(f'{tmpdir}/pythonfilter'))
+
+    def testForkWaitsForReload(self):
+        self.addCleanup(setattr, dispatcher, 'serve', dispatcher.serve)
+        dispatcher.serve = lambda *args: None
+        reloading = threading.Event()
+        started = []
+
+        def reload():
+            # A reload holds fork_lock while it runs.
+            with dispatcher.fork_lock:
+                reloading.set()
+                time.sleep(0.2)
+                started.append(time.time())
+        thread = threading.Thread(target=reload)
+        thread.start()
+        reloading.wait(5)
+        pid = dispatcher.start_process(None, None, 0)
+        forked = time.time()
+        os.waitpid(pid, 0)
+        thread.join()
+        self.assertGreaterEqual(forked, started[0])
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestDispatcher)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+# pythonfilter -- A python framework for Courier global filters
+# Copyright (C) 2007-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import courier.isolate
+
+
+test_filter = '''
+import os
+import time
+
+def do_filter(body_path, control_paths):
+    if body_path == 'sleep':
+        time.sleep(10)
+    elif body_path == 'crash':
+        os._exit(1)
+    elif body_path == 'raise':
+        raise ValueError(body_path)
+    elif body_path == 'none':
+        return None
+    return '%s %s %d' % (body_path, ' '.join(control_paths), os.getpid())
+'''
+
+
+class TestCourierIsolate(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        os.mkdir(f'{self.tmpdir}/pythonfilter')
+        open(f'{self.tmpdir}/pythonfilter/__init__.py', 'w').close()
+        with open(f'{self.tmpdir}/pythonfilter/isolate_test.py', 'w') as module_file:
+            module_file.write(test_filter)
+        sys.path.insert(0, self.tmpdir)
+        self.pool = courier.isolate.Pool('isolate_test', 1, max_messages=2)
+
+    def tearDown(self):
+        self.pool.close()
+        sys.path.remove(self.tmpdir)
+        shutil.rmtree(self.tmpdir)
+
+    def testCall(self):
+        reply = self.pool.call('body', ['control1', 'control2']).split()
+        self.assertEqual(reply[:3], ['body', 'control1', 'control2'])
+        # The worker is used again, until it reaches max_messages.
+        self.assertEqual(self.pool.call('body', []).split()[1], reply[3])
+        self.assertNotEqual(self.pool.call('body', []).split()[1], reply[3])
+
+    def testFailures(self):
+        pid = self.pool.call('body', []).split()[1]
+        self.assertRaises(courier.isolate.FilterError, self.pool.call, 'raise', [])
+        self.assertRaises(courier.isolate.WorkerTimeout, self.pool.call, 'sleep', [], 0.5)
+        self.assertRaises(courier.isolate.IsolateError, self.pool.call, 'crash', [])
+        self.assertNotEqual(self.pool.call('body', []).split()[1], pid)
+
+    def testNonString(self):
+        # As in the dispatcher, a reply that isn't a string is no
+        # decision, rather than an exception.
+        self.assertEqual(self.pool.call('none', []), '')
+
+    def testBusyTimeout(self):
+        self.pool.max_messages = 0
+        started = time.time()
+        call = threading.Thread(target=self.assertRaises,
+                                args=(courier.isolate.WorkerTimeout, self.pool.call,
+                                      'sleep', [], 1))
+        call.start()
+        # The only worker is busy, so the wait for it counts toward
+        # the timeout.
+        time.sleep(0.2)
+        self.assertRaises(courier.isolate.WorkerTimeout, self.pool.call, 'body', [], 0.3)
+        self.assertLess(time.time() - started, 0.9)
+        call.join()
+        self.assertTrue(self.pool.call('body', [], 5).startswith('body'))
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCourierIsolate)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+# pythonfilter -- A python framework for Courier global filters
+# Copyright (C) 2007-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+import io
+import json
+import sys
+import threading
+import time
+import unittest
+import courier.log
+
+
+class BlockingStderr(io.StringIO):
+    """A stderr whose writes wait until it is released."""
+    def __init__(self):
+        io.StringIO.__init__(self)
+        self.release = threading.Event()
+        self.writing = threading.Event()
+
+    def write(self, text):
+        self.writing.set()
+        self.release.wait()
+        return io.StringIO.write(self, text)
+
+
+class TestCourierLog(unittest.TestCase):
+
+    def setUp(self):
+        self.stderr = sys.stderr
+
+    def tearDown(self):
+        sys.stderr = self.stderr
+        courier.log._queue = None
+        courier.log._json_lines = False
+
+    def testWrite(self):
+        sys.stderr = io.StringIO()
+        courier.log.write('first line', field=1)
+        self.assertEqual(sys.stderr.getvalue(), 'first line\n')
+        courier.log.start(size=10, json_lines=True)
+        courier.log.write('second line', field=2)
+        courier.log.flush()
+        record = json.loads(sys.stderr.getvalue().splitlines()[1])
+        self.assertEqual(record['message'], 'second line')
+        self.assertEqual(record['field'], 2)
+        self.assertTrue(record['time'])
+        self.assertRaises(ValueError, courier.log.start, 'nowhere')
+
+    def testDropped(self):
+        sys.stderr = BlockingStderr()
+        dropped = courier.log.dropped_lines.get() or 0
+        courier.log.start(size=2)
+        courier.log.write('line 0')
+        # Wait until the writer is blocked writing the first line, then
+        # fill the queue.
+        sys.stderr.writing.wait(5)
+        for x in range(1, 6):
+            courier.log.write('line %d' % x)
+        self.assertEqual(courier.log.dropped_lines.get(), dropped + 3)
+        sys.stderr.release.set()
+        courier.log.flush()
+        self.assertEqual(sys.stderr.getvalue().splitlines(),
+                         ['line 0', 'line 1', 'line 2', 'pythonfilter dropped 3 log lines'])
+
+    def testFlushTimeout(self):
+        sys.stderr = BlockingStderr()
+        courier.log.start(size=10)
+        # With nothing queued, flush returns at once.
+        self.assertTrue(courier.log.flush(0.1))
+        courier.log.write('blocked line')
+        sys.stderr.writing.wait(5)
+        # flush doesn't wait for a stderr that doesn't accept lines.
+        start = time.time()
+        self.assertFalse(courier.log.flush(0.2))
+        self.assertLess(time.time() - start, 2)
+        sys.stderr.release.set()
+        self.assertTrue(courier.log.flush())
+        self.assertEqual(sys.stderr.getvalue(), 'blocked line\n')
+        courier.log._queue = None
+        self.assertTrue(courier.log.flush())
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCourierLog)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,95 @@
+#!/usr/bin/python3
+# pythonfilter -- A python framework for Courier global filters
+# Copyright (C) 2007-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+import shutil
+import socket
+import tempfile
+import unittest
+import courier.metrics
+
+
+class TestCourierMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = courier.metrics.Registry()
+
+    def testCounter(self):
+        counter = self.registry.counter('test_verdicts', 'Verdicts', ('filter', 'verdict'))
+        counter.inc('clamav', '5xx')
+        counter.inc('clamav', '5xx', amount=2)
+        counter.inc('spf"check', 'none')
+        self.assertEqual(counter.get('clamav', '5xx'), 3)
+        self.assertRaises(ValueError, counter.inc, 'clamav')
+        self.assertEqual(self.registry.render(),
+                         '# TYPE test_verdicts counter\n'
+                         '# HELP test_verdicts Verdicts\n'
+                         'test_verdicts_total{filter="clamav",verdict="5xx"} 3\n'
+                         'test_verdicts_total{filter="spf\\"check",verdict="none"} 1\n'
+                         '# EOF\n')
+
+    def testGauge(self):
+        values = [4]
+        self.registry.gauge('test_in_progress', 'In progress', function=lambda: values[0])
+        values[0] = 7
+        self.assertIn('\ntest_in_progress 7\n', self.registry.render())
+        self.registry.gauge('test_busy', 'Busy', ('lane',),
+                            function=lambda: {('relayed',): 2, ('other',): 5})
+        self.assertIn('\ntest_busy{lane="other"} 5\ntest_busy{lane="relayed"} 2\n',
+                      self.registry.render())
+
+    def testHistogram(self):
+        histogram = self.registry.histogram('test_seconds', 'Seconds', ('filter',),
+                                            buckets=(0.1, 1))
+        for x in (0.05, 0.5, 0.5, 5):
+            histogram.observe(x, 'debug')
+        self.assertEqual(histogram.render(),
+                         '# TYPE test_seconds histogram\n'
+                         '# HELP test_seconds Seconds\n'
+                         'test_seconds_bucket{filter="debug",le="0.1"} 1\n'
+                         'test_seconds_bucket{filter="debug",le="1"} 3\n'
+                         'test_seconds_bucket{filter="debug",le="+Inf"} 4\n'
+                         'test_seconds_sum{filter="debug"} 6.05\n'
+                         'test_seconds_count{filter="debug"} 4\n')
+
+    def testServe(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.registry.counter('test_messages', 'Messages').inc()
+            server = courier.metrics.serve(f'{tmpdir}/metrics', self.registry)
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(f'{tmpdir}/metrics')
+            client.sendall(b'GET /metrics HTTP/1.0\r\n\r\n')
+            response = b''
+            while True:
+                data = client.recv(4096)
+                if not data:
+                    break
+                response += data
+            client.close()
+            server.shutdown()
+            server.server_close()
+            self.assertTrue(response.startswith(b'HTTP/1.0 200'))
+            self.assertTrue(response.endswith(b'test_messages_total 1\n# EOF\n'))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCourierMetrics)
+    unittest.TextTestRunner(verbosity=2).run(suite)
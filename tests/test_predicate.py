@@ -0,0 +1,60 @@
+#!/usr/bin/python3
+# pythonfilter -- A python framework for Courier global filters
+# Copyright (C) 2007-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+import courier.context
+import courier.predicate
+
+
+class TestCourierPredicate(unittest.TestCase):
+
+    def setUp(self):
+        queuefiles = f'{os.path.dirname(__file__)}/queuefiles'
+        self.context = courier.context.MessageContext(f'{queuefiles}/data-test1',
+                                                      [f'{queuefiles}/control-duplicate'])
+
+    def check(self, text):
+        return courier.predicate.compile(text)(self.context)
+
+    def testTerms(self):
+        self.assertFalse(self.check('authenticated'))
+        self.assertTrue(self.check('rcpt-domain=Ascension.private.dragonsdawn.net'))
+        self.assertFalse(self.check('rcpt-domain=example.com'))
+        self.assertTrue(self.check('size>1'))
+        self.assertFalse(self.check('size>1M'))
+        self.assertTrue(self.check('size<1k'))
+
+    def testOperators(self):
+        self.assertTrue(self.check('not authenticated'))
+        self.assertTrue(self.check('authenticated or size<1k'))
+        self.assertFalse(self.check('authenticated or size<1k and size>1M'))
+        self.assertFalse(self.check('(authenticated or size<1k) and size>1M'))
+        self.assertTrue(self.check('not (authenticated or size>1M)'))
+
+    def testErrors(self):
+        for text in ('', 'size>1G', 'authenticated or', '(authenticated',
+                     'authenticated)', 'rcpt-domain=', 'and relayed', 'authenticated relayed'):
+            self.assertRaises(courier.predicate.PredicateError,
+                              courier.predicate.compile, text)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCourierPredicate)
+    unittest.TextTestRunner(verbosity=2).run(suite)
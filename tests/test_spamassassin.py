@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+# pythonfilter -- A python framework for Courier global filters
+# Copyright (C) 2007-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import tempfile
+import unittest
+import courier.breaker
+from filters.pythonfilter import spamassassin
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+body_path = f'{project_root}/tests/queuefiles/data-test1'
+control_path = f'{project_root}/tests/queuefiles/control-duplicate'
+
+
+class TestSpamassassin(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.spamc_path = spamassassin.spamc_path
+        self.spamd_breaker = spamassassin.spamd_breaker
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        spamassassin.spamc_path = self.spamc_path
+        spamassassin.spamd_breaker = self.spamd_breaker
+
+    def probe(self):
+        raise IOError('spamd is down')
+
+    def testUnavailable(self):
+        spamassassin.spamd_breaker = courier.breaker.Breaker('test_spamd', self.probe,
+                                                             failures=2, timeout=60)
+        # spamc reports that it couldn't reach spamd.
+        spamassassin.spamc_path = f'{self.tmpdir}/spamc'
+        with open(spamassassin.spamc_path, 'w') as spamc:
+            spamc.write('#!/bin/sh\ncat > /dev/null\nexit 69\n')
+        os.chmod(spamassassin.spamc_path, 0o755)
+        self.assertEqual(spamassassin.do_filter(body_path, [control_path]),
+                         '454 Spam scanner unavailable, try again later')
+        # spamc can't be run.
+        spamassassin.spamc_path = f'{self.tmpdir}/missing'
+        self.assertEqual(spamassassin.do_filter(body_path, [control_path]),
+                         '454 Spam scanner unavailable, try again later')
+        # The breaker is open, so spamc isn't run.
+        self.assertEqual(spamassassin.spamd_breaker.state, courier.breaker.OPEN)
+        self.assertEqual(spamassassin.do_filter(body_path, [control_path]),
+                         '454 Spam scanner unavailable, try again later')
+        self.assertEqual(courier.breaker.breaker_rejections.get('test_spamd'), 1)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSpamassassin)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+# pythonfilter -- A python framework for Courier global filters
+# Copyright (C) 2007-2008  Gordon Messmer <gordon@dragonsdawn.net>
+#
+# This file is part of pythonfilter.
+#
+# pythonfilter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pythonfilter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pythonfilter.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+import _thread
+import courier.trace
+
+
+class TestCourierTrace(unittest.TestCase):
+
+    def testFormat(self):
+        trace = courier.trace.Trace(1000.5)
+        trace.add('queue', 0.25)
+        trace.add('filter:clamav', 0.125, 0.0625)
+        line = trace.format('<id@example.com>')
+        self.assertEqual(line, '1000.500000 <id@example.com> queue=0.250000 '
+                         'filter:clamav=0.125000/0.062500\n')
+        self.assertEqual(courier.trace.parse(line),
+                         (1000.5, '<id@example.com>',
+                          [('queue', 0.25, None), ('filter:clamav', 0.125, 0.0625)]))
+        self.assertEqual(trace.format(None).split()[1], '-')
+
+    def testSummarize(self):
+        lines = ['%d - queue=%d filter:a=1/0.5 lock:ttldb.x=1 lock:ttldb.x=%d\n' % (x, x, x)
+                 for x in range(1, 101)]
+        summary = courier.trace.summarize(lines + ['\n'])
+        self.assertEqual(summary['queue']['count'], 100)
+        self.assertEqual(summary['queue'][0.5], 50)
+        self.assertEqual(summary['queue'][0.99], 99)
+        self.assertEqual(summary['queue']['cpu'], None)
+        self.assertEqual(summary['filter:a']['cpu'], 0.5)
+        # Repeated spans are added together for each message.
+        self.assertEqual(summary['lock:ttldb.x'][0.9], 91)
+
+    def testBlocked(self):
+        lock = _thread.allocate_lock()
+        # Without a current trace, nothing is recorded.
+        self.assertTrue(courier.trace.acquire(lock, 'test'))
+        lock.release()
+        trace = courier.trace.Trace()
+        token = courier.trace.activate(trace)
+        try:
+            courier.trace.acquire(lock, 'test')
+            lock.release()
+            self.assertEqual(courier.trace.blocked('other', max, 1, 2), 2)
+        finally:
+            courier.trace.deactivate(token)
+        self.assertEqual(courier.trace.current(), None)
+        self.assertEqual([x[0] for x in trace.spans], ['lock:test', 'lock:other'])
+
+    def testWrite(self):
+        self.assertEqual(courier.trace.start(), None)
+        (fd, path) = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            courier.trace.open_log(path)
+            trace = courier.trace.start()
+            trace.add('total', 1)
+            courier.trace.write(trace, 'id')
+            courier.trace.write(trace, 'id')
+            with open(path) as trace_file:
+                self.assertEqual(len(trace_file.readlines()), 2)
+        finally:
+            os.close(courier.trace._log_fd)
+            courier.trace._log_fd = None
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCourierTrace)
+    unittest.TextTestRunner(verbosity=2).run(suite)
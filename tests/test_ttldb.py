@@ -58,6 +58,15 @@ class TestTtlDb(unittest.TestCase):
         self.assertEqual(int(db['name2']), int(value2))
         self.assertEqual(int(db['name2\' -- ']), int(value2))
 
+    def testOpenDbmFiles(self):
+        courier.config._standard_config_paths = f'{os.path.dirname(__file__)}/configfiles/pythonfilter-modules.conf'
+        db = ttldb.TtlDb('testOpenDbmFiles', 1, 1)
+        paths = [x for x in ttldb.open_dbm_files() if x.endswith('/testOpenDbmFiles')]
+        self.assertEqual(len(paths), 1)
+        # The file is closed with its last instance.
+        del db
+        self.assertNotIn(paths[0], ttldb.open_dbm_files())
+
 
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestTtlDb)